@@ -1,4 +1,4 @@
-import requests
+import httpclient
 
 # This script fetches a list of movies from the ABC iView catalogue.
 # It uses the public API endpoint to retrieve movie data.
@@ -12,9 +12,6 @@ collection_urls = {
     "shows-timeless-tv-classics": "https://api.iview.abc.net.au/v3/collection/4154",
     "shows-tv-shows-for-big-kids": "https://api.iview.abc.net.au/v3/collection/3664",
 }
-headers = {
-    "User-Agent": "Mozilla/5.0",
-}
 
 
 def get_abc_media_list(collection="movies-of-the-week"):
@@ -27,7 +24,7 @@ def get_abc_media_list(collection="movies-of-the-week"):
         )
     url = collection_urls[collection]
 
-    response = requests.get(url, headers=headers)
+    response = httpclient.get(url)
     if response.status_code != 200:
         raise Exception(f"Failed to fetch data: {response.status_code}")
 
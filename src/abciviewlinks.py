@@ -1,4 +1,4 @@
-import requests
+import httpclient
 
 
 program_id = "bluey"
@@ -13,7 +13,7 @@ def get_abc_episode_links(url):
     :param url: API URL for the specific program and season
     :return: List of episode links
     """
-    data = requests.get(url).json()
+    data = httpclient.get(url).json()
     episodes = data["_embedded"]["selectedSeries"]["_embedded"]["videoEpisodes"][
         "items"
     ]
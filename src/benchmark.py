@@ -0,0 +1,261 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from binarycache import write_binary_cache
+from faketmdb import start_fake_tmdb
+from tmdb import _get_tmdb_media_list_async, iter_tmdb_media_async
+from tmdbcache import BinaryCache, JsonCache, SqliteCache
+from utils import save_to_json_file
+
+# Micro-benchmarks for the TMDB enrichment pipeline. These run entirely offline.
+# Usage: python src/benchmark.py [benchmark ...]
+
+
+def make_cache_entry(i):
+    """
+    Build a synthetic cache entry shaped like the ones stored in cache/tmdb.json.
+    """
+    return {
+        "cacheKey": f"movie-Title {i}-{1950 + i % 75}",
+        "title": f"Title {i}",
+        "year": str(1950 + i % 75),
+        "tmdbPopularity": (i % 1000) / 10,
+        "tmdbRating": (i % 100) / 10,
+        "tmdbRatingCount": i % 5000,
+        "imdbID": f"tt{i:07d}",
+    }
+
+
+def fill_cache(backend, size, directory):
+    """
+    Create a cache of the given backend holding `size` synthetic entries.
+    """
+    if backend == "json":
+        cache = JsonCache(os.path.join(directory, f"tmdb-{size}.json"))
+        cache.entries.update(
+            (entry["cacheKey"], entry) for entry in map(make_cache_entry, range(size))
+        )
+        return cache
+
+    if backend == "binary":
+        filename = os.path.join(directory, f"tmdb-{size}.bin")
+        write_binary_cache(list(map(make_cache_entry, range(size))), filename)
+        return BinaryCache(filename)
+
+    cache = SqliteCache(os.path.join(directory, f"tmdb-{size}.db"))
+    with cache.connection:
+        cache.connection.executemany(
+            "INSERT OR REPLACE INTO tmdb_cache (cache_key, data) VALUES (?, ?)",
+            (
+                (entry["cacheKey"], json.dumps(entry))
+                for entry in map(make_cache_entry, range(size))
+            ),
+        )
+    return cache
+
+
+def bench_cache_hits(sizes=(1_000, 10_000, 100_000, 1_000_000), lookups=100_000):
+    """
+    Time the cache-hit path for caches of increasing size.
+    """
+    print(f"{'backend':>8} {'entries':>10} {'ns/lookup':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in ["json", "sqlite", "binary"]:
+            for size in sizes:
+                cache = fill_cache(backend, size, directory)
+                keys = [
+                    make_cache_entry(random.randrange(size))["cacheKey"]
+                    for _ in range(lookups)
+                ]
+
+                start = time.perf_counter()
+                for key in keys:
+                    cache.get(key)
+                elapsed = time.perf_counter() - start
+                print(f"{backend:>8} {size:>10} {elapsed / lookups * 1e9:>10.0f}")
+                if backend != "json":
+                    cache.close()
+
+
+def bench_cache_startup(size=1_000_000):
+    """
+    Time opening a cache and making the first lookup, for a JSON and a binary
+    cache holding the same entries.
+    """
+    entries = list(map(make_cache_entry, range(size)))
+    key = entries[size // 2]["cacheKey"]
+    print(f"{'format':>8} {'entries':>10} {'bytes':>12} {'ms':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        json_filename = os.path.join(directory, "tmdb.json")
+        save_to_json_file(entries, json_filename)
+        binary_filename = os.path.join(directory, "tmdb.bin")
+        write_binary_cache(entries, binary_filename)
+        del entries
+
+        for name, cache_class, filename in [
+            ("json", JsonCache, json_filename),
+            ("binary", BinaryCache, binary_filename),
+        ]:
+            start = time.perf_counter()
+            cache = cache_class(filename)
+            cache.get(key)
+            elapsed = time.perf_counter() - start
+            cache.close()
+            del cache
+            print(
+                f"{name:>8} {size:>10} {os.path.getsize(filename):>12} {elapsed * 1e3:>10.1f}"
+            )
+
+
+def make_media_list(size):
+    """
+    Build a list of synthetic media items shaped like the media sources' output.
+    """
+    return [
+        {
+            "mediaType": "movie" if i % 2 else "show",
+            "title": f"Title {i}",
+            "year": str(1950 + i % 75),
+        }
+        for i in range(size)
+    ]
+
+
+def bench_tmdb_throughput(
+    sizes=(10_000, 100_000), concurrency_levels=(50, 200), latency=0.02
+):
+    """
+    Time cold TMDB enrichment runs, with an empty cache, against the fake TMDB
+    server for increasing numbers of items and concurrency.
+    """
+    print(
+        f"{'concurrency':>11} {'items':>8} {'requests':>9} {'seconds':>8} {'items/s':>8}"
+    )
+    for concurrency in concurrency_levels:
+        for size in sizes:
+            media_list = make_media_list(size)
+            elapsed, requests = asyncio.run(
+                time_tmdb_run(media_list, concurrency, latency)
+            )
+            print(
+                f"{concurrency:>11} {size:>8} {requests:>9} {elapsed:>8.1f} {size / elapsed:>8.0f}"
+            )
+
+
+async def time_tmdb_run(media_list, concurrency, latency):
+    """
+    Async: Enrich the media list against a fresh fake TMDB server, with the cache
+    in a temporary directory and the per-item output silenced. Returns the run
+    time and the number of requests the server got.
+    """
+    runner, base_url = await start_fake_tmdb(latency=latency)
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as directory, open(
+            os.devnull, "w"
+        ) as devnull, contextlib.redirect_stdout(devnull):
+            os.chdir(directory)
+            start = time.perf_counter()
+            await _get_tmdb_media_list_async(
+                "benchmark",
+                media_list,
+                concurrency=concurrency,
+                requests_per_second=None,
+                base_url=base_url,
+            )
+            elapsed = time.perf_counter() - start
+            os.chdir(cwd)
+        return elapsed, runner.app["stats"]["requests"]
+    finally:
+        os.chdir(cwd)
+        await runner.cleanup()
+
+
+def bench_tmdb_memory(sizes=(10_000, 200_000)):
+    """
+    Measure the peak RSS of cold TMDB enrichment runs against the fake TMDB
+    server, each in a fresh process. The results are streamed and dropped, and
+    the SQLite cache is used so the cache does not grow in memory, leaving the
+    enrichment pipeline's own memory use on top of the input media list.
+    """
+    print(f"{'items':>8} {'input MB':>9} {'peak MB':>8} {'pipeline MB':>12}")
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        with context.Pool(1) as pool:
+            input_rss, peak_rss = pool.apply(measure_tmdb_memory, (size,))
+        print(
+            f"{size:>8} {input_rss / 2**20:>9.1f} {peak_rss / 2**20:>8.1f} "
+            f"{(peak_rss - input_rss) / 2**20:>12.1f}"
+        )
+
+
+def measure_tmdb_memory(size):
+    """
+    Run a search-only cold enrichment of size items, dropping each result.
+    Returns the peak RSS in bytes once the media list is built and at the end.
+    """
+    import resource
+
+    def get_peak_rss():
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+    async def enrich(media_list):
+        runner, base_url = await start_fake_tmdb()
+        try:
+            async for _ in iter_tmdb_media_async(
+                "benchmark",
+                media_list,
+                cache_backend="sqlite",
+                requests_per_second=None,
+                search_only=True,
+                base_url=base_url,
+            ):
+                pass
+        finally:
+            await runner.cleanup()
+
+    media_list = make_media_list(size)
+    input_rss = get_peak_rss()
+    with tempfile.TemporaryDirectory() as directory, open(
+        os.devnull, "w"
+    ) as devnull, contextlib.redirect_stdout(devnull):
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            asyncio.run(enrich(media_list))
+        finally:
+            os.chdir(cwd)
+    return input_rss, get_peak_rss()
+
+
+benchmarks = {
+    "cache-hits": bench_cache_hits,
+    "cache-startup": bench_cache_startup,
+    "tmdb-throughput": bench_tmdb_throughput,
+    "tmdb-memory": bench_tmdb_memory,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Movie Rating Checker benchmarks")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"The benchmarks to run, any of {list(benchmarks.keys())}. Runs all of them if none are given.",
+    )
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f"Invalid benchmark '{name}'.")
+    for name in args.benchmarks or benchmarks:
+        print(f"Running benchmark '{name}'...")
+        benchmarks[name]()
@@ -0,0 +1,167 @@
+import mmap
+import struct
+import sys
+import zlib
+from array import array
+
+# Compact binary on-disk format for cached TMDB entries, read through mmap so a
+# lookup only touches the pages it needs instead of decoding the whole cache.
+#
+# Layout (little-endian):
+#   header          magic, entry count, hash index bucket count
+#   hash index      one u32 per bucket: entry number + 1, or 0 if empty
+#   columns         one fixed-width column per field in FIELDS, in order:
+#                   strings as (u32 offset, u32 length) into the string table,
+#                   ints as i64 and floats as f64
+#   present mask    one u16 per entry: bit n set if FIELDS[n] is in the entry
+#   null mask       one u16 per entry: bit n set if FIELDS[n] is None
+#   string table    UTF-8 bytes of every string field
+
+MAGIC = b"TMDBBIN1"
+HEADER = struct.Struct("<8sQQ")
+FIELDS = [
+    ("cacheKey", "str"),
+    ("title", "str"),
+    ("year", "str"),
+    ("imdbID", "str"),
+    ("tmdbStatus", "str"),
+    ("tmdbID", "int"),
+    ("tmdbPopularity", "float"),
+    ("tmdbRating", "float"),
+    ("tmdbRatingCount", "int"),
+    ("cachedAt", "float"),
+    ("lastAccessed", "float"),
+]
+column_formats = {"str": "II", "int": "q", "float": "d"}
+array_typecodes = {"str": "I", "int": "q", "float": "d"}
+
+
+class BinaryCacheReader:
+    """
+    Read-only view of a binary cache file.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.bucket_count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"'{filename}' is not a binary TMDB cache file")
+
+        offset = HEADER.size
+        self.index_offset = offset
+        offset += 4 * self.bucket_count
+        self.columns = []
+        for name, kind in FIELDS:
+            column = struct.Struct("<" + column_formats[kind])
+            self.columns.append((name, kind, column, offset))
+            offset += column.size * self.count
+        self.present_offset = offset
+        offset += 2 * self.count
+        self.null_offset = offset
+        offset += 2 * self.count
+        self.strings_offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def get(self, cache_key):
+        """
+        Lookup an entry using the cache key.
+        """
+        if not self.count:
+            return None
+        key = cache_key.encode("utf-8")
+        _, _, key_column, key_offset = self.columns[0]
+        bucket = zlib.crc32(key) & (self.bucket_count - 1)
+        while True:
+            (slot,) = struct.unpack_from("<I", self.mm, self.index_offset + 4 * bucket)
+            if not slot:
+                return None
+            i = slot - 1
+            start, length = key_column.unpack_from(
+                self.mm, key_offset + key_column.size * i
+            )
+            start += self.strings_offset
+            if self.mm[start : start + length] == key:
+                return self.read(i)
+            bucket = (bucket + 1) & (self.bucket_count - 1)
+
+    def items(self):
+        """
+        Iterate over every entry in the file.
+        """
+        for i in range(self.count):
+            yield self.read(i)
+
+    def read(self, i):
+        (present,) = struct.unpack_from("<H", self.mm, self.present_offset + 2 * i)
+        (null,) = struct.unpack_from("<H", self.mm, self.null_offset + 2 * i)
+        tmdb_media = {}
+        for bit, (name, kind, column, offset) in enumerate(self.columns):
+            if not present & (1 << bit):
+                continue
+            if null & (1 << bit):
+                tmdb_media[name] = None
+                continue
+            value = column.unpack_from(self.mm, offset + column.size * i)
+            if kind == "str":
+                start = self.strings_offset + value[0]
+                tmdb_media[name] = self.mm[start : start + value[1]].decode("utf-8")
+            else:
+                tmdb_media[name] = value[0]
+        return tmdb_media
+
+    def close(self):
+        self.mm.close()
+
+
+def write_binary_cache(entries, filename):
+    """
+    Write a list of cache entries to a binary cache file. Fields not in FIELDS
+    are not stored.
+    """
+    count = len(entries)
+    bucket_count = 2
+    while bucket_count < 2 * count:
+        bucket_count *= 2
+
+    index = array("I", bytes(4 * bucket_count))
+    columns = [array(array_typecodes[kind]) for _, kind in FIELDS]
+    present_mask = array("H")
+    null_mask = array("H")
+    strings = bytearray()
+
+    for i, tmdb_media in enumerate(entries):
+        present = null = 0
+        for bit, ((name, kind), column) in enumerate(zip(FIELDS, columns)):
+            value = tmdb_media.get(name)
+            if name in tmdb_media:
+                present |= 1 << bit
+                if value is None:
+                    null |= 1 << bit
+            if value is None:
+                column.extend([0, 0] if kind == "str" else [0])
+            elif kind == "str":
+                encoded = str(value).encode("utf-8")
+                column.extend([len(strings), len(encoded)])
+                strings += encoded
+            else:
+                column.append(int(value) if kind == "int" else float(value))
+        present_mask.append(present)
+        null_mask.append(null)
+
+        bucket = zlib.crc32(tmdb_media["cacheKey"].encode("utf-8")) & (bucket_count - 1)
+        while index[bucket]:
+            bucket = (bucket + 1) & (bucket_count - 1)
+        index[bucket] = i + 1
+
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, count, bucket_count))
+        for data in [index, *columns, present_mask, null_mask]:
+            if sys.byteorder != "little":
+                data.byteswap()
+            data.tofile(f)
+        f.write(strings)
+
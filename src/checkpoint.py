@@ -0,0 +1,219 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from utils import create_dir_if_not_exists, read_json_file, save_to_json_file
+
+# Progress of a cli.py run, so an interrupted run can be resumed with --resume
+# without fetching its media sources or enriching finished media again.
+#
+#   media.json      the requested media sources and the ones fully fetched so far
+#   media.jsonl     one [source, media] line per media fetched, in the order they
+#                   were sent to enrichment, appended in batches
+#   results.jsonl   one [index, media] line per media enriched with TMDB data,
+#                   appended in batches
+#
+# Media sources are merged in order, so media of sources that were not fully
+# fetched always come last in media.jsonl and are dropped on resume.
+
+CHECKPOINT_DIR = "cache/checkpoint"
+CHECKPOINT_INTERVAL_SECONDS = 30  # Save progress at least this often
+CHECKPOINT_INTERVAL_ITEMS = 500  # Save progress once this many media are waiting
+
+
+class Checkpoint:
+    """
+    Checkpoint of a cli.py run in a directory. Media added with add_media() and
+    add() are saved every interval_seconds or interval_items, whichever comes
+    first. Media may be added from several threads.
+    """
+
+    def __init__(
+        self,
+        directory=CHECKPOINT_DIR,
+        interval_seconds=CHECKPOINT_INTERVAL_SECONDS,
+        interval_items=CHECKPOINT_INTERVAL_ITEMS,
+    ):
+        self.directory = directory
+        self.sources_filename = os.path.join(directory, "media.json")
+        self.media_filename = os.path.join(directory, "media.jsonl")
+        self.results_filename = os.path.join(directory, "results.jsonl")
+        self.interval_seconds = interval_seconds
+        self.interval_items = interval_items
+        self.media_sources = None
+        self.media_file = None
+        self.results_file = None
+        self.unsaved_media = []
+        self.unsaved_results = []
+        self.saved_at = time.monotonic()
+        self.loaded_media_size = 0
+        self.loaded_results = {}
+        self.lock = threading.RLock()
+
+    def load(self, media_sources):
+        """
+        Load the checkpoint of an interrupted run of the same media sources.
+        Returns the media sources it fully fetched, the media fetched from them and
+        its enriched media by index in that media list, or None if there is no
+        such checkpoint.
+        """
+        if not os.path.exists(self.sources_filename):
+            print("No checkpoint found, starting from scratch")
+            return None
+        checkpoint = read_json_file(self.sources_filename)
+        if "mediaList" in checkpoint:
+            print("Checkpoint is from an older version, starting from scratch")
+            return None
+        if checkpoint["mediaSources"] != media_sources:
+            print("Checkpoint is for different media sources, starting from scratch")
+            return None
+        fetched_sources = checkpoint["fetchedSources"]
+
+        media_list = []
+        self.loaded_media_size = 0
+        if os.path.exists(self.media_filename):
+            with open(self.media_filename, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # Cut short when the run was killed
+                    source, media = json.loads(line)
+                    if source not in fetched_sources:
+                        break
+                    media_list.append(media)
+                    self.loaded_media_size += len(line)
+
+        results = {}
+        if os.path.exists(self.results_filename):
+            with open(self.results_filename, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        i, tmdb_media = json.loads(line)
+                    except ValueError:
+                        continue  # Cut short when the run was killed
+                    if i < len(media_list):
+                        results[i] = tmdb_media
+        self.loaded_results = results
+        return fetched_sources, media_list, results
+
+    def start(self, media_sources, fetched_sources, resume=False):
+        """
+        Start saving the progress of a run. When resuming, the media and enriched
+        media returned by load() are kept.
+        """
+        create_dir_if_not_exists(self.directory)
+        self.media_sources = media_sources
+        if resume:
+            if os.path.exists(self.media_filename):
+                with open(self.media_filename, "rb+") as f:
+                    f.truncate(self.loaded_media_size)
+            temp_filename = self.results_filename + ".tmp"
+            with open(temp_filename, "w", encoding="utf-8") as f:
+                for result in sorted(self.loaded_results.items()):
+                    f.write(json.dumps(list(result), ensure_ascii=False) + "\n")
+            os.replace(temp_filename, self.results_filename)
+        else:
+            for filename in [self.media_filename, self.results_filename]:
+                if os.path.exists(filename):
+                    os.remove(filename)
+        self.media_file = open(self.media_filename, "a", encoding="utf-8")
+        self.results_file = open(self.results_filename, "a", encoding="utf-8")
+        self.save_sources(fetched_sources)
+        self.saved_at = time.monotonic()
+
+    def add_media(self, source, media):
+        """
+        Add a media fetched from a media source, at the next index of the media list.
+        """
+        with self.lock:
+            self.unsaved_media.append([source, media])
+            self.save_if_due()
+
+    def finish_source(self, fetched_sources):
+        """
+        Record that a media source has been fully fetched, saving its media first.
+        """
+        with self.lock:
+            self.save()
+            self.save_sources(fetched_sources)
+
+    def add(self, i, tmdb_media):
+        """
+        Add the enriched media at index i of the media list. Skipped media are
+        left for the resumed run.
+        """
+        if tmdb_media.get("tmdbStatus") == "skipped":
+            return
+        with self.lock:
+            self.unsaved_results.append([i, tmdb_media])
+            self.save_if_due()
+
+    def save_if_due(self):
+        """
+        Save if interval_items media are waiting or interval_seconds have passed.
+        """
+        if (
+            len(self.unsaved_media) + len(self.unsaved_results) >= self.interval_items
+            or time.monotonic() - self.saved_at >= self.interval_seconds
+        ):
+            self.save()
+
+    def save(self):
+        """
+        Append the media and enriched media added since the last save to disk.
+        Media are saved before the results that refer to them.
+        """
+        with self.lock:
+            for f, unsaved in [
+                (self.media_file, self.unsaved_media),
+                (self.results_file, self.unsaved_results),
+            ]:
+                for line in unsaved:
+                    f.write(json.dumps(line, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.unsaved_media = []
+            self.unsaved_results = []
+            self.saved_at = time.monotonic()
+
+    def save_sources(self, fetched_sources):
+        """
+        Write the requested and fully fetched media sources.
+        """
+        temp_filename = self.sources_filename + ".tmp"
+        save_to_json_file(
+            {"mediaSources": self.media_sources, "fetchedSources": fetched_sources},
+            temp_filename,
+        )
+        os.replace(temp_filename, self.sources_filename)
+
+    def close(self):
+        """
+        Save the media added since the last save and keep the checkpoint for a
+        resumed run.
+        """
+        with self.lock:
+            if self.results_file is not None:
+                self.save()
+                self.close_files()
+        print(f"Saved checkpoint to {self.directory}, continue with --resume")
+
+    def remove(self):
+        """
+        Delete the checkpoint once the run has finished.
+        """
+        with self.lock:
+            self.close_files()
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+
+    def close_files(self):
+        """
+        Close the media and results files.
+        """
+        for f in [self.media_file, self.results_file]:
+            if f is not None:
+                f.close()
+        self.media_file = None
+        self.results_file = None
@@ -1,48 +1,64 @@
 import argparse
 import os
+import queue
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from checkpoint import Checkpoint
+import httpclient
+from httpclient import print_connection_stats
 from tenplay import get_10play_media_list
 from abciview import get_abc_media_list
 from sbs import get_sbs_media_list
-from tmdb import get_tmdb_media_list
-from tubi import get_tubi_media_list
+from tmdb import iter_tmdb_media_list
+from tmdbexport import open_title_index
+from tubi import get_tubi_media_list, iter_tubi_pages
 from utils import (
     create_dir_if_not_exists,
     delete_dir_if_exists,
     read_json_file,
     read_text_file,
     save_to_json_file,
+    set_http_timeouts,
 )
 
+SOURCE_CONCURRENCY = 8  # Max media sources fetched at once
+SOURCE_HOST_CONCURRENCY = 4  # Max media sources of the same provider fetched at once
+CANCEL_POLL_SECONDS = 0.5  # How often a wait for a media source page checks for a stop
+
+media_sources = [
+    "10play-movies",
+    "10play-shows-comedy",
+    "10play-shows-drama",
+    "10play-shows-kids",
+    "abc-movies-a-z",
+    "abc-movies-of-the-week",
+    "abc-shows-best-of-british-tv",
+    "abc-shows-comedy-gold",
+    "abc-shows-time-for-a-rewatch",
+    "abc-shows-timeless-tv-classics",
+    "abc-shows-tv-shows-for-big-kids",
+    "sbs-movies-all",
+    "sbs-movies-recently-added",
+    "sbs-shows-all",
+    "sbs-shows-bingeable-box-sets",
+    "sbs-shows-recently-added",
+    "tubi-award-winners-and-nominees",
+    "tubi-cult-classics",
+    "tubi-most-popular",
+    "tubi-recently-added",
+    "tubi-trending-now",
+]
+
 
 def main():
     parser = argparse.ArgumentParser(description="Movie Rating Checker CLI")
     parser.add_argument(
         "media_sources",
         nargs="*",
-        choices=[
-            "10play-movies",
-            "10play-shows-comedy",
-            "10play-shows-drama",
-            "10play-shows-kids",
-            "abc-movies-a-z",
-            "abc-movies-of-the-week",
-            "abc-shows-best-of-british-tv",
-            "abc-shows-comedy-gold",
-            "abc-shows-time-for-a-rewatch",
-            "abc-shows-timeless-tv-classics",
-            "abc-shows-tv-shows-for-big-kids",
-            "sbs-movies-all",
-            "sbs-movies-recently-added",
-            "sbs-shows-all",
-            "sbs-shows-bingeable-box-sets",
-            "sbs-shows-recently-added",
-            "tubi-award-winners-and-nominees",
-            "tubi-cult-classics",
-            "tubi-most-popular",
-            "tubi-recently-added",
-            "tubi-trending-now",
-        ],
+        choices=media_sources,
         help="The media sources to check. You can specify multiple sources separated by spaces.",
     )
     parser.add_argument(
@@ -85,7 +101,101 @@ def main():
         default="tmdb-rating",
         help="Sort the movies by 'tmdb-rating' or 'tmdb-popularity'. Default is 'tmdb-rating'.",
     )
+    parser.add_argument(
+        "--cache-backend",
+        choices=["json", "sqlite", "binary"],
+        default="json",
+        help="Where to cache TMDB data: 'json' (cache/tmdb.json), 'sqlite' (cache/tmdb.db) or 'binary' (cache/tmdb.bin). Default is 'json'.",
+    )
+    parser.add_argument(
+        "--cache-ttl-days",
+        type=float,
+        default=30,
+        help="Days before cached TMDB ratings are considered stale. Default is 30.",
+    )
+    parser.add_argument(
+        "--refresh-budget",
+        type=int,
+        default=100,
+        help="Maximum number of stale cached TMDB entries to re-fetch per run, oldest first "
+        "with the JSON cache. Default is 100.",
+    )
+    parser.add_argument(
+        "--not-found-ttl-days",
+        type=float,
+        default=7,
+        help="Days before titles TMDB had no results for are searched again. Default is 7.",
+    )
+    parser.add_argument(
+        "--failed-ttl-hours",
+        type=float,
+        default=1,
+        help="Hours before TMDB lookups that failed with an HTTP error are retried. Default is 1.",
+    )
+    parser.add_argument(
+        "--tmdb-requests-per-second",
+        type=float,
+        default=40,
+        help="Maximum TMDB requests per second. The rate backs off automatically when TMDB answers 429. Default is 40.",
+    )
+    parser.add_argument(
+        "--tmdb-max-attempts",
+        type=int,
+        default=4,
+        help="Maximum attempts per TMDB request on server errors, timeouts and connection errors. Default is 4.",
+    )
+    parser.add_argument(
+        "--tmdb-retry-budget",
+        type=int,
+        default=500,
+        help="Maximum number of TMDB requests retried per run. Default is 500.",
+    )
+    parser.add_argument(
+        "--tmdb-search-only",
+        action="store_true",
+        help="Take TMDB ratings from the search results and only look up the full TMDB details "
+        "(IMDb ID, canonical title and year) for media that pass the rating filters.",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=10,
+        help="Seconds to wait for a connection to any server. Default is 10.",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=30,
+        help="Seconds to wait for any server to send data. Default is 30.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds the whole run may take. When it is reached, the remaining media are skipped "
+        "and the output is marked partial. No deadline by default.",
+    )
+    parser.add_argument(
+        "--source-concurrency",
+        type=int,
+        default=SOURCE_CONCURRENCY,
+        help=f"Maximum media sources fetched at once. Default is {SOURCE_CONCURRENCY}.",
+    )
+    parser.add_argument(
+        "--source-host-concurrency",
+        type=int,
+        default=SOURCE_HOST_CONCURRENCY,
+        help="Maximum media sources of the same provider (10play, abc, sbs or tubi) "
+        f"fetched at once. Default is {SOURCE_HOST_CONCURRENCY}.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run of the same media sources from its checkpoint, "
+        "skipping the media sources and media it already finished.",
+    )
     args = parser.parse_args()
+    deadline = time.monotonic() + args.deadline if args.deadline else None
+    set_http_timeouts(args.connect_timeout, args.read_timeout)
 
     # Get the TMDB API key
     tmdb_api_key = args.tmdb_api_key or read_text_file("input/tmdb_api_key.txt").strip()
@@ -96,6 +206,7 @@ def main():
         sys.exit(1)
 
     # Get Tubi access token if needed
+    tubi_access_token = None
     if any(source.startswith("tubi-") for source in args.media_sources):
         tubi_access_token = read_text_file("input/tubi_access_token.txt").strip()
         if not tubi_access_token:
@@ -104,25 +215,110 @@ def main():
             )
             sys.exit(1)
 
-    # Get media list from specified sources
-    media_list = []
-    for source in args.media_sources:
-        if source.startswith("10play-"):
-            media_list.extend(get_10play_media_list(source.replace("10play-", "")))
-        elif source.startswith("abc-"):
-            media_list.extend(get_abc_media_list(source.replace("abc-", "")))
-        elif source.startswith("sbs-"):
-            media_list.extend(get_sbs_media_list(source.replace("sbs-", "")))
-        elif source.startswith("tubi-"):
-            media_list.extend(
-                get_tubi_media_list(
-                    access_token=tubi_access_token,
-                    collection=source.replace("tubi-", ""),
-                )
-            )
+    # Stop cleanly on SIGINT or SIGTERM, saving progress for --resume
+    stop_signals = handle_stop_signals()
+    checkpoint = Checkpoint()
+    resumed = checkpoint.load(args.media_sources) if args.resume else None
+    fetched_sources, media_list, finished_media = resumed or ([], [], {})
+    if resumed:
+        print(
+            f"Resuming with {len(finished_media)} of {len(media_list)} media already "
+            f"enriched from {len(fetched_sources)} media sources"
+        )
+
+    checkpoint.start(args.media_sources, fetched_sources, resume=resumed is not None)
+
+    # Load previous output if exists
+    previous_output_file = "cache/previous-media.json"
+    previous_media_list = None
+    if os.path.exists(previous_output_file):
+        previous_media_list = []
+        try:
+            previous_media_list = read_json_file(previous_output_file)
+            print(f"Loaded {len(previous_media_list)} items from previous output")
+        except Exception as e:
+            print(f"Error loading previous output: {e}")
+    previous_titles = {m["title"] for m in previous_media_list or []}
+
+    # Index in media_list of each media sent to enrichment, in the order sent
+    indices = [i for i in range(len(media_list)) if i not in finished_media]
+
+    def iter_media():
+        # Resumed media first, then media from the remaining sources as their
+        # pages arrive, merged in order and checkpointed as they go
+        for i in indices[:]:
+            yield media_list[i]
+        for source, page in iter_media_pages(
+            [source for source in args.media_sources if source not in fetched_sources],
+            tubi_access_token,
+            args.source_concurrency,
+            args.source_host_concurrency,
+            deadline,
+        ):
+            if stop_signals:
+                return
+            if page is None:
+                fetched_sources.append(source)
+                checkpoint.finish_source(fetched_sources)
+                continue
+            for media in page:
+                checkpoint.add_media(source, media)
+                indices.append(len(media_list))
+                media_list.append(media)
+                yield media
 
-    # Enrich media list with TMDB data
-    tmdb_media_list = get_tmdb_media_list(tmdb_api_key, media_list)
+    # Enrich media with TMDB data as they are fetched, reporting matches as they arrive
+    tmdb_media_by_index = dict(finished_media)
+    partial = False
+    matched_media = set()
+    tmdb_media_iter = iter_tmdb_media_list(
+        tmdb_api_key,
+        iter_media(),
+        cache_backend=args.cache_backend,
+        cache_ttl_days=args.cache_ttl_days,
+        refresh_budget=args.refresh_budget,
+        not_found_ttl_days=args.not_found_ttl_days,
+        failed_ttl_hours=args.failed_ttl_hours,
+        requests_per_second=args.tmdb_requests_per_second,
+        max_attempts=args.tmdb_max_attempts,
+        retry_budget=args.tmdb_retry_budget,
+        search_only=args.tmdb_search_only,
+        needs_details=lambda media: passes_rating_filters(media, args),
+        deadline=deadline,
+        title_index=open_title_index(),
+    )
+    for j, media in tmdb_media_iter:
+        i = indices[j]
+        tmdb_media_by_index[i] = media
+        checkpoint.add(i, media)
+        if stop_signals:
+            break
+        if media.get("tmdbStatus") == "skipped":
+            partial = True
+        media_key = (media["mediaType"], media["title"])
+        if passes_rating_filters(media, args) and media_key not in matched_media:
+            matched_media.add(media_key)
+            new = "" if media["title"] in previous_titles else ", new"
+            print(
+                f"Match: {media['title']} ({media['mediaType']}, rated {media['tmdbRating']} "
+                f"by {media['tmdbRatingCount']}{new})"
+            )
+    tmdb_media_iter.close()
+    print_connection_stats()
+    if stop_signals:
+        checkpoint.close()
+        sys.exit(128 + stop_signals[0])
+    if any(source not in fetched_sources for source in args.media_sources):
+        partial = True
+    if partial:
+        checkpoint.close()
+    else:
+        checkpoint.remove()
+    tmdb_media_list = [
+        tmdb_media_by_index[i]
+        for i in range(len(media_list))
+        if i in tmdb_media_by_index
+    ]
 
     # Remove duplicates based on mediaType and title
     seen_media = set()
@@ -135,20 +331,7 @@ def main():
     tmdb_media_list = unique_tmdb_media_list
 
     # Filter by minimum rating count
-    tmdb_media_list = [
-        m
-        for m in tmdb_media_list
-        if (
-            m["mediaType"] == "movie"
-            and m.get("tmdbRating", 0) >= args.movies_min_rating
-            and m.get("tmdbRatingCount", 0) >= args.movies_min_rating_count
-        )
-        or (
-            m["mediaType"] == "show"
-            and m.get("tmdbRating", 0) >= args.shows_min_rating
-            and m.get("tmdbRatingCount", 0) >= args.shows_min_rating_count
-        )
-    ]
+    tmdb_media_list = [m for m in tmdb_media_list if passes_rating_filters(m, args)]
 
     # Sort the movies
     if args.sort_by == "tmdb-rating":
@@ -165,19 +348,14 @@ def main():
     all_output_file = f"{output_dir}/all-media.json"
     save_to_json_file(tmdb_media_list, all_output_file)
     print(f"Saved {len(tmdb_media_list)} media to {all_output_file}")
+    if partial:
+        partial_marker_file = f"{output_dir}/PARTIAL"
+        with open(partial_marker_file, "w", encoding="utf-8") as f:
+            f.write("The run reached its deadline before every media was checked.\n")
+        print(f"Output is partial, marked with {partial_marker_file}")
 
-    # Load previous output if exists
-    previous_output_file = "cache/previous-media.json"
-    if os.path.exists(previous_output_file):
-        previous_media_list = []
-        try:
-            previous_media_list = read_json_file(previous_output_file)
-            print(f"Loaded {len(previous_media_list)} items from previous output")
-        except Exception as e:
-            print(f"Error loading previous output: {e}")
-
-        # Find new additions
-        previous_titles = {m["title"] for m in previous_media_list}
+    # Find new additions since the previous output
+    if previous_media_list is not None:
         new_additions = [
             m for m in tmdb_media_list if m["title"] not in previous_titles
         ]
@@ -190,12 +368,177 @@ def main():
     else:
         print("No previous output found, skipping new media check.")
 
-    # Save current output as previous for next run
-    create_dir_if_not_exists("cache")
-    save_to_json_file(tmdb_media_list, previous_output_file)
+    # Save current output as previous for next run, unless it is missing media
+    if partial:
+        print("Not saving partial output as previous output.")
+    else:
+        create_dir_if_not_exists("cache")
+        save_to_json_file(tmdb_media_list, previous_output_file)
 
     print("Done.")
 
 
+def handle_stop_signals():
+    """
+    Make SIGINT and SIGTERM ask the run to stop once its progress is saved,
+    instead of stopping it straight away. A second signal stops it straight away.
+    The first signal also cancels the media sources still being fetched.
+    Returns the list that received signals are added to.
+    """
+    stop_signals = []
+
+    def request_stop(signum, frame):
+        if stop_signals:
+            raise KeyboardInterrupt
+        stop_signals.append(signum)
+        httpclient.cancelled.set()
+        print("Stopping once progress is saved, signal again to stop now")
+
+    for signum in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(signum, request_stop)
+    return stop_signals
+
+
+def passes_rating_filters(media, args):
+    """
+    Check whether a TMDB enriched media item meets the minimum rating and rating
+    count for its media type.
+    """
+    return (
+        media["mediaType"] == "movie"
+        and media.get("tmdbRating", 0) >= args.movies_min_rating
+        and media.get("tmdbRatingCount", 0) >= args.movies_min_rating_count
+    ) or (
+        media["mediaType"] == "show"
+        and media.get("tmdbRating", 0) >= args.shows_min_rating
+        and media.get("tmdbRatingCount", 0) >= args.shows_min_rating_count
+    )
+
+
+def iter_media_pages(
+    sources,
+    tubi_access_token=None,
+    concurrency=SOURCE_CONCURRENCY,
+    host_concurrency=SOURCE_HOST_CONCURRENCY,
+    deadline=None,
+    cancel=httpclient.cancelled,
+):
+    """
+    Fetch several media sources in a thread pool, with up to concurrency sources
+    at once and up to host_concurrency from the same provider. Yields each source
+    and a page of its media as soon as the page is ready, then the source and None
+    once it has been fully fetched. Pages are merged in the order of sources, so
+    the result does not depend on which source answers first. Stops early if the
+    deadline (a time.monotonic() time) passes before a source has been fetched.
+
+    The threading.Event cancel stops the fetching between pages once set, and
+    stops the iteration within CANCEL_POLL_SECONDS. It is set when iteration
+    stops early, e.g. at the deadline, so the fetches still running do not keep
+    the process alive. The default, httpclient.cancelled,
+    also stops the requests the media source modules have queued.
+    """
+    host_semaphores = {
+        get_source_host(source): threading.Semaphore(host_concurrency)
+        for source in sources
+    }
+    page_queues = [queue.Queue() for _ in sources]
+
+    def fetch(source, pages):
+        try:
+            with host_semaphores[get_source_host(source)]:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+                for page in get_media_pages(source, tubi_access_token):
+                    if cancel.is_set():
+                        return
+                    pages.put(page)
+            pages.put(None)
+        except Exception as e:
+            pages.put(e)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    futures = [
+        executor.submit(fetch, source, pages)
+        for source, pages in zip(sources, page_queues)
+    ]
+    finished = False
+    try:
+        for source, pages in zip(sources, page_queues):
+            while True:
+                if cancel.is_set():
+                    print(
+                        f"Stopped, skipping media source '{source}' "
+                        "and the ones after it"
+                    )
+                    return
+                timeout = CANCEL_POLL_SECONDS
+                if deadline is not None:
+                    timeout = min(timeout, max(0, deadline - time.monotonic()))
+                try:
+                    page = pages.get(timeout=timeout)
+                except queue.Empty:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        print(
+                            f"Deadline reached, skipping media source '{source}' "
+                            "and the ones after it"
+                        )
+                        return
+                    continue
+                if isinstance(page, Exception):
+                    if cancel.is_set():
+                        continue  # Cancelled while the page was being fetched
+                    raise page
+                yield source, page
+                if page is None:
+                    break
+        finished = True
+    finally:
+        if not finished:
+            cancel.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def get_source_host(source):
+    """
+    Get the provider a media source is fetched from, e.g. 'sbs' for 'sbs-movies-all'.
+    """
+    return source.split("-")[0]
+
+
+def get_media_pages(source, tubi_access_token=None):
+    """
+    Fetch the media of one of the media sources page by page. Tubi containers
+    are yielded a page at a time as their cursor is followed, other media
+    sources in one page.
+    """
+    if source.startswith("tubi-"):
+        yield from iter_tubi_pages(
+            access_token=tubi_access_token,
+            collection=source.replace("tubi-", ""),
+        )
+    else:
+        yield get_media_list(source, tubi_access_token)
+
+
+def get_media_list(source, tubi_access_token=None):
+    """
+    Fetch the media list of one of the media sources.
+    """
+    if source.startswith("10play-"):
+        return get_10play_media_list(source.replace("10play-", ""))
+    elif source.startswith("abc-"):
+        return get_abc_media_list(source.replace("abc-", ""))
+    elif source.startswith("sbs-"):
+        return get_sbs_media_list(source.replace("sbs-", ""))
+    elif source.startswith("tubi-"):
+        return get_tubi_media_list(
+            access_token=tubi_access_token,
+            collection=source.replace("tubi-", ""),
+        )
+    raise ValueError(f"Invalid media source '{source}'.")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import random
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+# Local stand-in for the TMDB API endpoints used by tmdb.py, for load tests and
+# benchmarks that must not touch the real API. Every title is found, with an ID
+# and ratings derived from the title, except for a not_found_rate share of them.
+# Latency, server errors and 429 rate limiting can be configured.
+# Usage: python src/faketmdb.py [options], then use http://127.0.0.1:<port>/3
+# as the TMDB API URL.
+
+tmdb_media_types = ["movie", "tv"]
+
+
+def create_fake_tmdb_app(
+    latency=0.0,
+    error_rate=0.0,
+    rate_limit=None,
+    retry_after=1,
+    not_found_rate=0.0,
+    seed=None,
+):
+    """
+    Build the fake TMDB app. Each response is delayed by latency seconds, give or
+    take 50%, and error_rate of requests fail with a 500. Once more than rate_limit
+    requests arrive in the same second, the rest are answered 429 with a
+    Retry-After of retry_after seconds. Request counts are kept in app["stats"].
+    """
+    rng = random.Random(seed)
+    stats = Counter()
+    window = {"second": 0, "requests": 0}
+
+    @web.middleware
+    async def fake_conditions(request, handler):
+        stats["requests"] += 1
+        if rate_limit:
+            second = int(time.monotonic())
+            if second != window["second"]:
+                window["second"] = second
+                window["requests"] = 0
+            window["requests"] += 1
+            if window["requests"] > rate_limit:
+                stats["throttled"] += 1
+                return web.Response(
+                    status=429, headers={"Retry-After": str(retry_after)}
+                )
+        if latency:
+            await asyncio.sleep(latency * rng.uniform(0.5, 1.5))
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.Response(status=500)
+        return await handler(request)
+
+    async def search(request):
+        media_type = request.match_info["media_type"]
+        title = request.query.get("query", "")
+        stats["searches"] += 1
+        tmdb_id = get_fake_tmdb_id(title)
+        if tmdb_id % 1000 < not_found_rate * 1000:
+            return web.json_response({"page": 1, "results": [], "total_results": 0})
+        result = get_fake_media(media_type, tmdb_id, title, request.query.get("year"))
+        return web.json_response({"page": 1, "results": [result], "total_results": 1})
+
+    async def lookup(request):
+        media_type = request.match_info["media_type"]
+        tmdb_id = int(request.match_info["tmdb_id"])
+        stats["lookups"] += 1
+        details = get_fake_media(media_type, tmdb_id)
+        details["imdb_id"] = f"tt{tmdb_id:07d}"
+        return web.json_response(details)
+
+    app = web.Application(middlewares=[fake_conditions])
+    app["stats"] = stats
+    for media_type in tmdb_media_types:
+        app.router.add_get(f"/3/search/{{media_type:{media_type}}}", search)
+        app.router.add_get(f"/3/{{media_type:{media_type}}}/{{tmdb_id:\\d+}}", lookup)
+    return app
+
+
+def get_fake_tmdb_id(title):
+    """
+    Derive a stable TMDB ID from a title.
+    """
+    return zlib.crc32(title.lower().encode("utf-8")) % 10_000_000 + 1
+
+
+def get_fake_media(media_type, tmdb_id, title=None, year=None):
+    """
+    Build a TMDB search result for a movie/show, with ratings derived from its ID.
+    """
+    title = title or f"Title {tmdb_id}"
+    date = f"{year or 1950 + tmdb_id % 75}-01-01"
+    return {
+        "id": tmdb_id,
+        "title" if media_type == "movie" else "name": title,
+        "release_date" if media_type == "movie" else "first_air_date": date,
+        "popularity": tmdb_id % 1000 / 10,
+        "vote_average": tmdb_id % 100 / 10,
+        "vote_count": tmdb_id % 5000,
+    }
+
+
+async def start_fake_tmdb(host="127.0.0.1", port=0, **options):
+    """
+    Async: Start the fake TMDB server on the running event loop. port 0 picks a
+    free port. See create_fake_tmdb_app for the options. Returns the app runner,
+    to clean up when done, and the base URL to use as the TMDB API URL.
+    """
+    runner = web.AppRunner(create_fake_tmdb_app(**options), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://{host}:{port}/3"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake TMDB API server")
+    parser.add_argument("--port", type=int, default=8765, help="Default is 8765.")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="Average seconds to delay each response by. Default is 0.05.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with a 500. Default is 0.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        help="Requests per second to allow before answering 429. No limit by default.",
+    )
+    parser.add_argument(
+        "--not-found-rate",
+        type=float,
+        default=0.0,
+        help="Share of titles with no search results. Default is 0.",
+    )
+    args = parser.parse_args()
+    print(f"Fake TMDB API at http://127.0.0.1:{args.port}/3")
+    web.run_app(
+        create_fake_tmdb_app(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            rate_limit=args.rate_limit,
+            not_found_rate=args.not_found_rate,
+        ),
+        host="127.0.0.1",
+        port=args.port,
+        access_log=None,
+    )
@@ -0,0 +1,108 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from utils import get_http_timeout
+
+# Shared HTTP client for the media source modules. Requests to the same host go
+# over one keep-alive session with its own connection pool, so a crawl of many
+# pages pays for one TCP and TLS handshake per connection, not one per page.
+
+POOL_SIZE = 16  # Max keep-alive connections kept per host
+
+# ACCEPT_ENCODING lists the encodings urllib3 can decode here: gzip and deflate,
+# plus br when brotli is installed
+default_headers = {
+    "Accept-Encoding": ACCEPT_ENCODING,
+    "User-Agent": "Mozilla/5.0",
+}
+
+sessions = {}  # Host -> keep-alive session
+sessions_lock = threading.Lock()
+# Once set, get raises RequestCancelled instead of sending the request, so media
+# sources still being fetched in other threads stop after their current request
+cancelled = threading.Event()
+
+
+class RequestCancelled(requests.RequestException):
+    """
+    Raised by get once requests have been cancelled by setting cancelled.
+    """
+
+
+def get(url, params=None, headers=None, timeout=None):
+    """
+    Send a GET request over the pooled session for the URL's host.
+
+    :param url: URL to get
+    :param params: Query params
+    :param headers: Headers to send on top of default_headers
+    :param timeout: (connect, read) timeout in seconds, from utils.get_http_timeout by default
+    :return: requests.Response
+    :raises RequestCancelled: If cancelled is set
+    """
+    if cancelled.is_set():
+        raise RequestCancelled(f"Request to {url} cancelled")
+    session = get_session(urlsplit(url).netloc)
+    return session.get(
+        url,
+        params=params,
+        headers=headers,
+        timeout=timeout or get_http_timeout(),
+    )
+
+
+def get_session(host):
+    """
+    Get the keep-alive session for a host, creating it on first use.
+
+    :param host: Host name, with the port if any
+    :return: requests.Session
+    """
+    with sessions_lock:
+        if host not in sessions:
+            session = requests.Session()
+            session.headers.update(default_headers)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            sessions[host] = session
+        return sessions[host]
+
+
+def get_connection_stats():
+    """
+    Count the requests sent to each host and the connections opened for them.
+
+    :return: Dict of host to a dict with 'requests', 'connections' and 'reused'
+    """
+    stats = {}
+    with sessions_lock:
+        for host, session in sessions.items():
+            requests_sent = 0
+            connections = 0
+            pool_manager = session.get_adapter(f"https://{host}").poolmanager
+            for key in pool_manager.pools.keys():
+                pool = pool_manager.pools[key]
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+            stats[host] = {
+                "requests": requests_sent,
+                "connections": connections,
+                "reused": requests_sent - connections,
+            }
+    return stats
+
+
+def print_connection_stats():
+    """
+    Print how many requests were sent to each host and over how many connections.
+    """
+    for host, stats in get_connection_stats().items():
+        print(
+            f"HTTP summary for {host}: {stats['requests']} requests over "
+            f"{stats['connections']} connections, {stats['reused']} reused"
+        )
@@ -1,6 +1,8 @@
 import base64
 import json
-import requests
+from concurrent.futures import ThreadPoolExecutor
+
+import httpclient
 
 # This script fetches a list of media in a collection from the SBS On Demand catalogue.
 # It uses the public API endpoint to retrieve collection data.
@@ -14,7 +16,6 @@ collection_urls = {
 }
 headers = {
     "Accept": "*/*",
-    "Accept-Encoding": "gzip, deflate, br",
     "Accept-Language": "en",
     "Origin": "https://www.sbs.com.au",
     "Priority": "u=3,i",
@@ -22,15 +23,16 @@ headers = {
     "Sec-Fetch-Dest": "empty",
     "Sec-Fetch-Mode": "cors",
     "Sec-Fetch-Site": "cross-site",
-    "User-Agent": "Mozilla/5.0",
 }
-items_per_page = "100"
-max_pages = 20
+items_per_page = 100
+page_concurrency = 4  # Pages fetched at once after the first
 
 
 def get_sbs_media_list(collection="recently-added-movies"):
     """
-    Fetch all media from a collection from the SBS On Demand catalogue.
+    Fetch all media from a collection from the SBS On Demand catalogue. The first
+    page tells how many media the collection has, and the rest of the pages are
+    then fetched concurrently, page_concurrency at a time.
     """
     if collection not in collection_urls:
         raise ValueError(
@@ -38,31 +40,29 @@ def get_sbs_media_list(collection="recently-added-movies"):
         )
     url = collection_urls[collection]
 
-    # Build the cursor query param
-    cursor_dict = {
-        "audio": "",
-        "genre": "",
-        "language": "",
-        "limit": items_per_page,
-        "page": "1",
-        "sort": "",
-        "subtitle": "",
-        "type": "",
-    }
+    first_page = get_sbs_page(url, 1)
+    pages = [first_page]
+    total = (first_page or {}).get("meta", {}).get("total")
+    if first_page and first_page.get("items") and total is not None:
+        page_count = -(-total // items_per_page)
+        print(f"Fetching {page_count} pages of {total} media...")
+        with ThreadPoolExecutor(max_workers=page_concurrency) as executor:
+            pages.extend(
+                executor.map(
+                    lambda page: get_sbs_page(url, page), range(2, page_count + 1)
+                )
+            )
+    elif first_page and first_page.get("items"):
+        # No total to go by, so fetch pages one by one until one comes back empty
+        page = 2
+        while pages[-1] and pages[-1].get("items"):
+            pages.append(get_sbs_page(url, page))
+            page += 1
 
     media_list = []
-    for page in range(1, max_pages + 1):
-        print(f"Fetching page {page}...")
-        cursor_dict["page"] = str(page)
-        cursor = base64.b64encode(json.dumps(cursor_dict).encode()).decode()
-
-        response = requests.get(url, headers=headers, params={"cursor": cursor})
-        if response.status_code != 200:
-            print(f"Failed to fetch data: {response.status_code}")
+    for data in pages:
+        if data is None:
             break
-
-        data = response.json()
-
         if not data.get("items"):
             print("No more items found, stopping.")
             break
@@ -83,6 +83,31 @@ def get_sbs_media_list(collection="recently-added-movies"):
     return media_list
 
 
+def get_sbs_page(url, page):
+    """
+    Fetch a page of a collection from the SBS On Demand catalogue. Returns the
+    response data, or None if the request failed.
+    """
+    print(f"Fetching page {page}...")
+    cursor_dict = {
+        "audio": "",
+        "genre": "",
+        "language": "",
+        "limit": str(items_per_page),
+        "page": str(page),
+        "sort": "",
+        "subtitle": "",
+        "type": "",
+    }
+    cursor = base64.b64encode(json.dumps(cursor_dict).encode()).decode()
+
+    response = httpclient.get(url, params={"cursor": cursor}, headers=headers)
+    if response.status_code != 200:
+        print(f"Failed to fetch data: {response.status_code}")
+        return None
+    return response.json()
+
+
 def get_media_type(media):
     entity_type = media["entityType"]
     if entity_type == "MOVIE":
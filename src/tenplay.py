@@ -1,6 +1,19 @@
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-MAX_PAGES = 20  # Maximum number of pages to fetch
+import httpclient
+
+# The 10 Play API pages through a genre by skipping the IDs already seen, listed in
+# the skipIdList query param, so every page makes the next request longer. To keep
+# that in check, a genre is fetched from both ends of its sort order at once, most
+# popular first and least popular first, until the two meet in the middle. Each end
+# only skips its own IDs, and stops at MAX_SKIP_IDS so no request grows unbounded;
+# a genre too large for both ends to meet within that is reported as incomplete.
+# If the API ignores the ascending sort direction, the genre is fetched from the
+# most popular end only.
+
+MAX_SKIP_IDS = 1000  # Maximum IDs to skip in one request, about 8 KB of URL
+sort_directions = ["descending", "ascending"]
 
 url = "https://10.com.au/api/shows"
 collection_genre_ids = {
@@ -9,11 +22,21 @@ collection_genre_ids = {
     "shows-drama": "23552",  # "https://10.com.au/shows/drama"
     "shows-kids": "23833",  # "https://10.com.au/shows/kids"
 }
+headers = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "en-AU,en;q=0.9",
+    "Priority": "u=3, i",
+    "Referer": "https://10.com.au/shows/drama",
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+}
 
 
 def get_10play_media_list(collection="shows-drama"):
     """
-    Fetch all media from a collection from the 10 Play catalogue.
+    Fetch all media from a collection from the 10 Play catalogue, from both ends
+    of its sort order at once.
     """
     if collection not in collection_genre_ids:
         raise ValueError(
@@ -21,58 +44,142 @@ def get_10play_media_list(collection="shows-drama"):
         )
     genre_id = collection_genre_ids[collection]
 
-    params = {
-        "skipIdList": "",
-        "genreId": genre_id,
-        "sort": "popular",
-        "sortDirection": "descending",
-    }
-    headers = {
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Accept-Language": "en-AU,en;q=0.9",
-        "Priority": "u=3, i",
-        "Referer": "https://10.com.au/shows/drama",
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-origin",
-        "User-Agent": "Mozilla/5.0",
-    }
-
-    media_list = []
-    for i in range(MAX_PAGES):
-        print(f"Fetching page {i}...")
-        response = requests.get(url, params=params, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-
-            if "items" in data:
-                media_list.extend(
-                    [
-                        {
-                            "mediaType": get_media_type(item),
-                            "title": item["name"],
-                            "10PlayURL": item["url"],
-                        }
-                        for item in data["items"]
-                    ]
+    with ThreadPoolExecutor(max_workers=len(sort_directions)) as executor:
+        first_pages = list(
+            executor.map(
+                lambda direction: get_10play_page(genre_id, direction, [], 0),
+                sort_directions,
+            )
+        )
+        first_ids = [
+            [item["id"] for item in page.get("items", [])] for page in first_pages
+        ]
+        if not first_pages[0].get("hasMore", False):
+            results = [(first_pages[0].get("items", []), "complete")]
+        elif first_ids[0] == first_ids[1]:
+            print(
+                "10 Play ignored the ascending sort direction, "
+                "fetching from the most popular end only."
+            )
+            results = [get_10play_items(genre_id, "descending", first_pages[0])]
+        elif set(first_ids[0]) & set(first_ids[1]):
+            print("Both sort directions met on their first page.")
+            results = [(page.get("items", []), "met") for page in first_pages]
+        else:
+            # Both first pages are recorded before either end goes on, so meeting
+            # the other end later always means real overlap
+            seen = {}  # ID -> the sort direction that found it
+            for direction, ids in zip(sort_directions, first_ids):
+                for item_id in ids:
+                    seen.setdefault(item_id, direction)
+            lock = threading.Lock()
+            results = list(
+                executor.map(
+                    lambda direction, first_page: get_10play_items(
+                        genre_id, direction, first_page, seen, lock
+                    ),
+                    sort_directions,
+                    first_pages,
                 )
+            )
 
-            ids = [str(item["id"]) for item in data["items"]]
-            params["skipIdList"] += "," if params["skipIdList"] else ""
-            params["skipIdList"] += ",".join(ids)
+    for direction, (_, status) in zip(sort_directions, results):
+        if status == "capped":
+            print(
+                f"Warning: 10 Play collection '{collection}' may be incomplete, "
+                f"stopped fetching {direction} after {MAX_SKIP_IDS} IDs to skip."
+            )
 
-            if not data.get("hasMore", False):
-                print(f"No more pages after page {i}.")
-                break
-        else:
-            print(f"Failed to fetch page {i}. Status code: {response.status_code}")
-            raise ConnectionError("Failed to fetch 10play collection page")
+    # Most popular first, then the least popular end in reverse
+    items = results[0][0] + (results[1][0][::-1] if len(results) > 1 else [])
+    media_list = []
+    ids = set()
+    for item in items:
+        if item["id"] in ids:
+            continue
+        ids.add(item["id"])
+        media_list.append(
+            {
+                "mediaType": get_media_type(item),
+                "title": item["name"],
+                "10PlayURL": item["url"],
+            }
+        )
 
     print(f"Total media found from 10 Play: {len(media_list)}")
     return media_list
 
 
+def get_10play_items(genre_id, sort_direction, first_page, seen=None, lock=None):
+    """
+    Fetch the items of a genre from the 10 Play catalogue in one sort direction,
+    going on from its first page, until there are no more pages ('complete'), a
+    page reaches items in seen found from the other direction ('met'), or
+    MAX_SKIP_IDS items have been skipped ('capped'). Returns the items and why
+    fetching stopped.
+    """
+    items = list(first_page.get("items", []))
+    skip_ids = [str(item["id"]) for item in items]
+    data = first_page
+    page = 0
+    while True:
+        if not data.get("hasMore", False) or not data.get("items"):
+            print(f"No more pages after page {page} ({sort_direction}).")
+            return items, "complete"
+        if len(skip_ids) > MAX_SKIP_IDS:
+            print(
+                f"Stopping after page {page} ({sort_direction}), more than "
+                f"{MAX_SKIP_IDS} IDs to skip."
+            )
+            return items, "capped"
+
+        page += 1
+        data = get_10play_page(genre_id, sort_direction, skip_ids, page)
+        page_items = data.get("items", [])
+        items.extend(page_items)
+        skip_ids.extend(str(item["id"]) for item in page_items)
+        if seen is not None:
+            with lock:
+                met = any(
+                    seen.get(item["id"], sort_direction) != sort_direction
+                    for item in page_items
+                )
+                for item in page_items:
+                    seen.setdefault(item["id"], sort_direction)
+            if met:
+                print(
+                    f"Met the other sort direction at page {page} ({sort_direction})."
+                )
+                return items, "met"
+
+
+def get_10play_page(genre_id, sort_direction, skip_ids, page):
+    """
+    Fetch a page of a genre from the 10 Play catalogue, skipping the given IDs.
+    """
+    params = {
+        "skipIdList": ",".join(skip_ids),
+        "genreId": genre_id,
+        "sort": "popular",
+        "sortDirection": sort_direction,
+    }
+    response = httpclient.get(url, params=params, headers=headers)
+    if response.status_code != 200:
+        print(
+            f"Failed to fetch page {page} ({sort_direction}). "
+            f"Status code: {response.status_code}"
+        )
+        raise ConnectionError("Failed to fetch 10play collection page")
+
+    # The decoded size, as Content-Length is missing from chunked responses
+    print(
+        f"Fetched page {page} ({sort_direction}): "
+        f"sent {len(response.request.url)} B of URL, "
+        f"received {len(response.content)} B of JSON"
+    )
+    return response.json()
+
+
 def get_media_type(item):
     """
     Determine the media type (movie or show) from a 10 Play item.
@@ -1,137 +1,929 @@
 import asyncio
+import atexit
+import heapq
+import random
+import re
+import time
+import unicodedata
+from collections import Counter
 import aiohttp
 
-from utils import create_dir_if_not_exists, read_json_file, save_to_json_file
+from tmdbcache import get_last_accessed, is_stale, open_cache
+from utils import get_http_timeout
 
-tmdb_movie_search_url = "https://api.themoviedb.org/3/search/movie"
-tmdb_movie_lookup_url = "https://api.themoviedb.org/3/movie"
-tmdb_show_search_url = "https://api.themoviedb.org/3/search/tv"
-tmdb_show_lookup_url = "https://api.themoviedb.org/3/tv"
+tmdb_api_url = "https://api.themoviedb.org/3"
+tmdb_media_types = {"movie": "movie", "show": "tv"}  # TMDB's name for each media type
 
 
 CONCURRENCY = 40  # Max concurrent requests to TMDB API
+REQUESTS_PER_SECOND = 40  # Max requests per second to TMDB API
+MAX_ATTEMPTS = 4  # Max attempts per TMDB request on server errors, timeouts and connection errors
+RETRY_BUDGET = 500  # Max retried TMDB requests per run
+MAX_THROTTLE_PAUSES = 20  # Max 429 Retry-After pauses per TMDB request
+CACHE_TTL_DAYS = 30  # Cached ratings older than this are considered stale
+REFRESH_BUDGET = 100  # Max stale cache entries to re-fetch per run
+NOT_FOUND_TTL_DAYS = 7  # Retry titles TMDB had no results for after this long
+FAILED_TTL_HOURS = 1  # Retry lookups that failed with an HTTP error after this long
+TOUCH_INTERVAL_DAYS = 7  # How often to record that a cache entry is still being used
+DNS_CACHE_TTL = 300  # Seconds to cache DNS lookups of the TMDB API host
+KEEPALIVE_TIMEOUT = 60  # Seconds to keep idle connections to TMDB open for reuse
 
+event_loop = None  # Persistent event loop that get_tmdb_media_list runs on
+shared_sessions = {}  # Pooled TMDB sessions on event_loop, by concurrency
 
-def get_tmdb_media_list(api_key, media_list):
+
+def get_tmdb_media_list(api_key, media_list, **options):
     """
-    Get TMDB details for a list of media items in parallel (up to 40 concurrent requests).
+    Get TMDB details for a list of media items in parallel.
     Each item in media_list must be a dict with 'mediaType', 'title' and optional 'year'.
+    See iter_tmdb_media_async for the options.
+    """
+    tmdb_media_by_index = {}
+    for i, tmdb_media in iter_tmdb_media_list(api_key, media_list, **options):
+        tmdb_media_by_index[i] = tmdb_media
+    return [tmdb_media_by_index[i] for i in range(len(tmdb_media_by_index))]
+
+
+def iter_tmdb_media_list(api_key, media_list, **options):
+    """
+    Get TMDB details for a list of media items in parallel, yielding each item's
+    index in media_list and its TMDB details as soon as they are ready.
+    See iter_tmdb_media_async for the options.
+
+    Every call runs on the same event loop and shares a pooled TMDB session, so
+    connections opened by one call are reused by the next. Requests only make
+    progress while the caller is waiting for the next item.
     """
-    return asyncio.run(_get_tmdb_media_list_async(api_key, media_list))
+    loop = get_event_loop()
+    session = loop.run_until_complete(
+        get_shared_session(options.get("concurrency", CONCURRENCY))
+    )
+    tmdb_media_iter = iter_tmdb_media_async(
+        api_key, media_list, session=session, **options
+    )
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(tmdb_media_iter.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(tmdb_media_iter.aclose())
 
 
-async def _get_tmdb_media_list_async(api_key, media_list):
-    cache = load_cache("cache/tmdb.json")
-    semaphore = asyncio.Semaphore(CONCURRENCY)
-    tmdb_media_list = []
+def get_event_loop():
+    """
+    Get the persistent event loop for get_tmdb_media_list, creating it on first use.
+    It is closed, along with the shared sessions, when the process exits.
+    """
+    global event_loop
+    if event_loop is None:
+        event_loop = asyncio.new_event_loop()
+        atexit.register(close_event_loop)
+    return event_loop
 
-    async with aiohttp.ClientSession() as session:
 
-        async def process_media(media):
-            tmdb_media = {}
-            cache_key = (
-                f"{media['mediaType']}-{media['title']}-{media.get('year', 'noyear')}"
+def close_event_loop():
+    """
+    Close the shared TMDB sessions and the persistent event loop.
+    """
+    global event_loop
+    for session in shared_sessions.values():
+        event_loop.run_until_complete(session.close())
+    shared_sessions.clear()
+    event_loop.close()
+    event_loop = None
+
+
+async def get_shared_session(concurrency):
+    """
+    Async: Get the shared TMDB session for the given concurrency, creating it on
+    first use. Must run on the persistent event loop.
+    """
+    if concurrency not in shared_sessions:
+        shared_sessions[concurrency] = new_tmdb_session(concurrency)
+    return shared_sessions[concurrency]
+
+
+def new_tmdb_session(
+    concurrency=CONCURRENCY,
+    dns_cache_ttl=DNS_CACHE_TTL,
+    keepalive_timeout=KEEPALIVE_TIMEOUT,
+):
+    """
+    Create a session for TMDB requests with a keep-alive connection pool of up to
+    concurrency connections and cached DNS lookups. Requests made with a stats
+    counter as their trace_request_ctx count the connections they open and reuse.
+    Must be called, and closed, on a running event loop.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=concurrency,
+        limit_per_host=concurrency,
+        ttl_dns_cache=dns_cache_ttl,
+        keepalive_timeout=keepalive_timeout,
+    )
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(count_connection("connections_opened"))
+    trace_config.on_connection_reuseconn.append(count_connection("connections_reused"))
+    return aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+
+def count_connection(counter):
+    """
+    Build a trace callback counting connections in the request's stats counter.
+    """
+
+    async def on_connection(session, trace_config_ctx, params):
+        stats = trace_config_ctx.trace_request_ctx
+        if stats is not None:
+            stats[counter] += 1
+
+    return on_connection
+
+
+async def _get_tmdb_media_list_async(api_key, media_list, **options):
+    """
+    Async: Get TMDB details for a list of media items, in the same order.
+    See iter_tmdb_media_async for the options.
+    """
+    tmdb_media_by_index = {}
+    async for i, tmdb_media in iter_tmdb_media_async(api_key, media_list, **options):
+        tmdb_media_by_index[i] = tmdb_media
+    return [tmdb_media_by_index[i] for i in range(len(tmdb_media_by_index))]
+
+
+async def iter_tmdb_media_async(
+    api_key,
+    media_list,
+    cache_backend="json",
+    cache_ttl_days=CACHE_TTL_DAYS,
+    refresh_budget=REFRESH_BUDGET,
+    not_found_ttl_days=NOT_FOUND_TTL_DAYS,
+    failed_ttl_hours=FAILED_TTL_HOURS,
+    concurrency=CONCURRENCY,
+    requests_per_second=REQUESTS_PER_SECOND,
+    max_requests=None,
+    max_attempts=MAX_ATTEMPTS,
+    retry_budget=RETRY_BUDGET,
+    search_only=False,
+    needs_details=None,
+    session=None,
+    base_url=tmdb_api_url,
+    deadline=None,
+    title_index=None,
+):
+    """
+    Async: Get TMDB details for a list of media items, yielding each item's index
+    in media_list and its TMDB details as they complete. A pool of concurrency
+    workers takes items from a bounded queue, so memory use does not grow with
+    the number of items. Up to concurrency requests are in flight, at most
+    requests_per_second (None for no limit), and at most max_requests in total.
+    Failed requests are retried up to max_attempts times each and retry_budget
+    times per run. Items left over once max_requests is used up are returned with
+    tmdbStatus 'skipped' and are not cached.
+
+    With search_only, items are enriched from the TMDB search result alone, which
+    has the ratings and popularity but no IMDb ID. The details lookup is only made
+    for items that needs_details returns True for, given the enriched item (or for
+    none if needs_details is None).
+
+    Results are cached using the given cache backend ('json', 'sqlite' or 'binary').
+    Cached entries older than cache_ttl_days are stale; at most refresh_budget of
+    them, oldest first, are re-fetched per run and the rest are used as they are.
+    Titles TMDB has no results for, and lookups that failed, are cached as negative
+    entries and retried after not_found_ttl_days and failed_ttl_hours respectively.
+
+    Requests are made to the TMDB API at base_url with the given aiohttp session,
+    or a new one from new_tmdb_session that is closed at the end of the run.
+
+    deadline is the time.monotonic() time the run must finish by. Requests still
+    in flight then are cancelled, no more are started, and unfinished items are
+    returned with tmdbStatus 'skipped'. Everything finished by then is cached.
+
+    Titles found in title_index (see tmdbexport.py) are resolved to their TMDB ID
+    without searching TMDB.
+
+    media_list may also be any other iterable, such as a generator that fetches
+    media page by page. Its items are then pulled in a worker thread as the pool
+    asks for them, so enrichment starts before it is exhausted. Stale details
+    are then refreshed oldest first among the entries recent runs used, if the
+    cache backend holds its entries in memory (see select_recent_stale_keys),
+    and otherwise as they come up, up to refresh_budget.
+    """
+    cache = open_cache(cache_backend)
+    limiter = RequestLimiter(
+        concurrency,
+        requests_per_second,
+        max_requests,
+        RetryPolicy(max_attempts, retry_budget),
+        deadline,
+    )
+    ttls = {
+        "found": cache_ttl_days * 86400,
+        "not-found": not_found_ttl_days * 86400,
+        "failed": failed_ttl_hours * 3600,
+    }
+    streamed = not isinstance(media_list, list)
+    if streamed:
+        refresh_keys = select_recent_stale_keys(cache, ttls, refresh_budget)
+        refresh_left = refresh_budget - len(refresh_keys)
+    else:
+        refresh_keys = select_stale_keys(
+            (lookup_cache(cache, media) for media in media_list), ttls, refresh_budget
+        )
+    stats = Counter()
+    inflight = {}
+    failures = []
+    own_session = session is None
+    if own_session:
+        session = new_tmdb_session(concurrency)
+    tasks = []
+
+    try:
+
+        def finish_flight(key, task):
+            del inflight[key]
+            refresh_keys.discard(key)
+            if not task.cancelled():
+                task.exception()  # Nobody may be waiting for it after a deadline
+
+        async def single_flight(key, fetch, served):
+            # Items that share a key while it is being fetched await the first fetch
+            # instead of repeating it; items after that find the result in the cache
+            if key in inflight:
+                result, requests = await asyncio.shield(inflight[key])
+                served["coalesced"] += 1
+                served["requests_saved"] += requests
+                return result
+            inflight[key] = asyncio.ensure_future(fetch())
+            inflight[key].add_done_callback(lambda task: finish_flight(key, task))
+            result, _ = await asyncio.shield(inflight[key])
+            served["fetched"] += 1
+            return result
+
+        def count_served(served):
+            # Each item counts once: as fetched (its requests are counted already),
+            # else as coalesced if it waited for another item's fetch, else as a hit
+            if served["fetched"]:
+                return
+            if served["coalesced"]:
+                stats["coalesced"] += 1
+                stats["requests_saved"] += served["requests_saved"]
+            elif served["cache_hits"]:
+                stats["cache_hits"] += 1
+
+        async def resolve_media(media, cache_key):
+            requests = Counter()
+            resolution, search_details = await get_media_from_tmdb_async(
+                api_key,
+                media,
+                cache_key,
+                session,
+                limiter,
+                stats=requests,
+                base_url=base_url,
+                title_index=title_index,
             )
-            cached = lookup_cache(cache, cache_key)
-            if cached:
-                print(f"Using cached TMDB data for key '{cache_key}'")
-                tmdb_media = cached
-            else:
-                tmdb_media = await get_media_from_tmdb_async(
-                    api_key, media, cache_key, session, semaphore
+            stats.update(requests)
+            resolution["cachedAt"] = int(time.time())
+            if resolution.get("tmdbResolvedFrom") != "export":
+                # Unverified export resolutions are looked up again every run
+                cache.put(resolution)
+            if has_full_details(search_details):
+                search_details["cachedAt"] = resolution["cachedAt"]
+                cache.put(search_details)
+            elif search_only and search_details:
+                # Never replace full details with the search result's subset
+                if not has_full_details(cache.get(search_details["cacheKey"])):
+                    search_details["cachedAt"] = resolution["cachedAt"]
+                    cache.put(search_details)
+            return resolution, requests["requests"]
+
+        async def fetch_details(media_type, tmdb_id, details):
+            requests = Counter()
+            try:
+                tmdb_media = await get_media_details_from_tmdb_async(
+                    api_key,
+                    media_type,
+                    tmdb_id,
+                    session,
+                    limiter,
+                    stats=requests,
+                    base_url=base_url,
+                )
+            except RequestBudgetExhausted:
+                if details is None:
+                    raise
+                tmdb_media = None
+            stats.update(requests)
+            if tmdb_media:
+                tmdb_media["cachedAt"] = int(time.time())
+                cache.put(tmdb_media)
+            elif details:
+                print(f"Keeping stale TMDB data for ID {tmdb_id}")
+                tmdb_media = details
+            return tmdb_media, requests["requests"]
+
+        def select_streamed_stale_keys(cached):
+            nonlocal refresh_left
+            cache_key, resolution, details_key, details = cached
+            now = time.time()
+            if resolution and not is_found(resolution):
+                if is_stale(resolution, ttls[resolution["tmdbStatus"]], now):
+                    refresh_keys.add(cache_key)
+            elif (
+                refresh_left
+                and details_key not in refresh_keys
+                and details
+                and is_stale(details, ttls["found"], now)
+            ):
+                refresh_keys.add(details_key)
+                refresh_left -= 1
+
+        async def process_media(media):
+            cached = lookup_cache(cache, media)
+            if streamed:
+                select_streamed_stale_keys(cached)
+            touch_cached_entries(cache, [cached])
+            served = Counter()
+            try:
+                tmdb_media = await enrich_media(media, *cached, served)
+                count_served(served)
+                return tmdb_media
+            except RequestBudgetExhausted:
+                stats["skipped"] += 1
+                return {**media, "tmdbStatus": "skipped"}
+
+        async def process_media_by_deadline(media):
+            if deadline is None:
+                return await process_media(media)
+            try:
+                return await asyncio.wait_for(
+                    process_media(media), max(0, deadline - time.monotonic())
                 )
-                if tmdb_media:
-                    cache.append(tmdb_media)
-            return {**media, **(tmdb_media or {})}
+            except asyncio.TimeoutError:
+                if not stats["skipped"]:
+                    print("Deadline reached, skipping unfinished media")
+                stats["skipped"] += 1
+                return {**media, "tmdbStatus": "skipped"}
 
-        tasks = [process_media(media) for media in media_list]
-        tmdb_media_list = await asyncio.gather(*tasks)
+        def needs_lookup(media, details):
+            if has_full_details(details):
+                return False
+            if not search_only:
+                return True
+            return needs_details is not None and needs_details({**media, **details})
 
-    # Save updated cache
-    create_dir_if_not_exists("cache")
-    save_to_json_file(cache, "cache/tmdb.json")
-    return tmdb_media_list
+        async def enrich_media(
+            media, cache_key, resolution, details_key, details, served
+        ):
+            searched = False
+            if resolution is None or cache_key in refresh_keys:
+                if resolution:
+                    print(f"Refreshing TMDB data for key '{cache_key}'")
+                resolution = await single_flight(
+                    cache_key, lambda: resolve_media(media, cache_key), served
+                )
+                if not is_found(resolution):
+                    return {**media, **resolution}
+                details_key = get_details_key(media["mediaType"], resolution["tmdbID"])
+                details = cache.get(details_key)
+                searched = True
+            elif not is_found(resolution):
+                served["cache_hits"] += 1
+                return {**media, **resolution}
+
+            if (
+                details is None
+                or details_key in refresh_keys
+                or needs_lookup(media, details)
+            ):
+                if details_key in refresh_keys:
+                    print(f"Refreshing stale TMDB details for key '{details_key}'")
+                details = await single_flight(
+                    details_key,
+                    lambda: fetch_details(
+                        media["mediaType"], resolution["tmdbID"], details
+                    ),
+                    served,
+                )
+                if details is None:
+                    return {**media, **get_negative_media(media, cache_key, "failed")}
+            elif searched and not has_full_details(details):
+                stats["search_only"] += 1
+            else:
+                print(f"Using cached TMDB data for key '{cache_key}'")
+                served["cache_hits"] += 1
+            return {**media, **details}
+
+        queue = asyncio.Queue(maxsize=concurrency)
+        results = asyncio.Queue(maxsize=concurrency)
 
+        async def feed_queue():
+            try:
+                if streamed:
+                    # Pull from the iterable off the event loop, it may block on I/O
+                    loop = asyncio.get_event_loop()
+                    items = iter(media_list)
+                    i = 0
+                    while True:
+                        media = await loop.run_in_executor(None, next, items, None)
+                        if media is None:
+                            break
+                        await queue.put((i, media))
+                        i += 1
+                else:
+                    for item in enumerate(media_list):
+                        await queue.put(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures.append(e)
+            for _ in range(concurrency):
+                await queue.put(None)
 
-def load_cache(filename):
+        async def work_queue():
+            try:
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    i, media = item
+                    await results.put((i, await process_media_by_deadline(media)))
+            except Exception as e:
+                failures.append(e)
+            finally:
+                await results.put(None)
+
+        tasks = [asyncio.ensure_future(feed_queue())]
+        tasks.extend(asyncio.ensure_future(work_queue()) for _ in range(concurrency))
+        running = concurrency
+        while running:
+            result = await results.get()
+            if failures:
+                raise failures[0]
+            if result is None:
+                running -= 1
+                continue
+            yield result
+        if failures:
+            raise failures[0]
+    finally:
+        # Stop anything still running if the caller stopped iterating early
+        pending = [task for task in [*tasks, *inflight.values()] if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if own_session:
+            await session.close()
+
+        # Save updated cache
+        cache.close()
+        print_run_summary(stats)
+
+
+def normalize_title(title):
     """
-    Load cached TMDB data from a JSON file.
+    Normalize a title for matching: lowercase, without accents, punctuation or
+    repeated whitespace, with '&' spelled out as 'and'.
     """
-    try:
-        cache = read_json_file(filename)
-        print(f"Loaded {len(cache)} items from cache")
-        return cache
-    except FileNotFoundError:
-        print("Cache file not found, starting with empty cache")
-        return []
+    title = unicodedata.normalize("NFKD", title)
+    title = "".join(c for c in title if not unicodedata.combining(c))
+    title = title.lower().replace("&", " and ")
+    return " ".join(re.sub(r"[^\w\s]", " ", title).split())
 
 
-def lookup_cache(cache, cache_key):
+def get_cache_key(media):
     """
-    Lookup a movie in the cache using the cache key.
+    Build the cache key that resolves a media item to a TMDB ID from its type,
+    normalized title and year.
+    """
+    title = normalize_title(media["title"])
+    return f"{media['mediaType']}-{title}-{media.get('year') or 'noyear'}"
+
+
+def get_legacy_cache_key(media):
+    """
+    Build the cache key used before title resolution and TMDB details were cached
+    separately, when each entry held both.
+    """
+    return f"{media['mediaType']}-{media['title']}-{media.get('year', 'noyear')}"
+
+
+def get_details_key(media_type, tmdb_id):
+    """
+    Build the cache key for the TMDB details of a movie or show.
+    """
+    return f"tmdb:{media_type}:{tmdb_id}"
+
+
+def lookup_cache(cache, media):
+    """
+    Lookup a media item in the cache. Returns its resolution cache key, the cached
+    resolution (or None), and the cache key and cached entry holding its details.
+    Entries cached before resolutions were split out hold both, so they are
+    returned as both the resolution and the details.
+    """
+    cache_key = get_cache_key(media)
+    resolution = cache.get(cache_key)
+    if resolution is None:
+        legacy = cache.get(get_legacy_cache_key(media))
+        if legacy is not None:
+            return cache_key, legacy, cache_key, legacy
+        return cache_key, None, None, None
+    if not is_found(resolution):
+        return cache_key, resolution, None, None
+    details_key = get_details_key(media["mediaType"], resolution["tmdbID"])
+    return cache_key, resolution, details_key, cache.get(details_key)
+
+
+def touch_cached_entries(cache, cached_list):
+    """
+    Record that the cached entries found by lookup_cache are still in use, so
+    compaction does not evict them. Each entry is touched at most once every
+    TOUCH_INTERVAL_DAYS to keep cache writes on the hit path rare.
+    """
+    now = int(time.time())
+    for _, resolution, _, details in cached_list:
+        for tmdb_media in [resolution, details]:
+            if (
+                tmdb_media
+                and now - get_last_accessed(tmdb_media) > TOUCH_INTERVAL_DAYS * 86400
+            ):
+                cache.touch(tmdb_media["cacheKey"], now)
+                tmdb_media["lastAccessed"] = now
+
+
+def is_found(tmdb_media):
+    """
+    Check whether a cache entry holds real TMDB data rather than a negative result.
+    Entries cached before statuses were recorded count as found.
+    """
+    return bool(tmdb_media) and tmdb_media.get("tmdbStatus", "found") == "found"
+
+
+def has_full_details(tmdb_media):
     """
-    return next(
-        (m for m in cache if m["cacheKey"] == cache_key),
-        None,
+    Check whether a cache entry holds the full TMDB details rather than only what
+    the search result had. Full details always record the IMDb ID, even if None.
+    """
+    return bool(tmdb_media) and "imdbID" in tmdb_media
+
+
+def select_stale_keys(cached_list, ttls, refresh_budget):
+    """
+    Pick the cache keys to refresh this run from the results of lookup_cache.
+    Expired negative resolutions are always retried; stale details are refreshed
+    oldest first, up to refresh_budget. ttls maps each entry status to its TTL in
+    seconds. Found resolutions do not expire.
+    """
+    now = time.time()
+    expired_keys = set()
+    stale_cached_at = {}
+    for cache_key, resolution, details_key, details in cached_list:
+        if resolution and not is_found(resolution):
+            if is_stale(resolution, ttls[resolution["tmdbStatus"]], now):
+                expired_keys.add(cache_key)
+        elif details and is_stale(details, ttls["found"], now):
+            stale_cached_at[details_key] = details.get("cachedAt", 0)
+    oldest_first = heapq.nsmallest(
+        refresh_budget, stale_cached_at, key=stale_cached_at.get
+    )
+    if expired_keys:
+        print(f"Retrying {len(expired_keys)} expired negative cache entries")
+    if stale_cached_at:
+        print(
+            f"Found {len(stale_cached_at)} stale cache entries, refreshing up to {refresh_budget}"
+        )
+    return expired_keys | set(oldest_first)
+
+
+def select_recent_stale_keys(cache, ttls, refresh_budget):
+    """
+    Pick the stale details keys to refresh, oldest first and up to refresh_budget,
+    before the media list is known, among the cache entries used within the last
+    two TOUCH_INTERVAL_DAYS, so titles no longer listed do not take up the budget.
+    Only caches that hold their entries in memory are scanned; the others would
+    have to decode every entry, so nothing is picked for them.
+    """
+    if not cache.in_memory:
+        return set()
+    used_since = time.time() - 2 * TOUCH_INTERVAL_DAYS * 86400
+    return select_stale_keys(
+        (
+            (None, None, details_key, details)
+            for details_key, details in cache.entries.items()
+            if details_key.startswith("tmdb:")
+            and get_last_accessed(details) >= used_since
+        ),
+        ttls,
+        refresh_budget,
+    )
+
+
+def print_run_summary(stats):
+    """
+    Print the counters collected during a TMDB enrichment run.
+    """
+    print(
+        f"TMDB summary: {stats['requests']} requests, {stats['cache_hits']} cache hits, "
+        f"{stats['coalesced']} items coalesced saving {stats['requests_saved']} requests, "
+        f"{stats['export_resolved']} titles resolved from ID exports, "
+        f"{stats['search_only']} details lookups skipped, "
+        f"{stats['retries']} retries, {stats['throttled']} throttled, "
+        f"{stats['skipped']} items skipped, {stats['connections_opened']} connections "
+        f"opened and {stats['connections_reused']} reused"
     )
 
 
-async def get_media_from_tmdb_async(api_key, media, cache_key, session, semaphore):
+class RequestBudgetExhausted(Exception):
+    """
+    Raised when a run has used up its TMDB request budget or passed its deadline.
+    """
+
+
+class RetryPolicy:
     """
-    Async: Get TMDB movie/show details by title and optional year.
+    How failed TMDB requests are retried: up to max_attempts per request, with
+    exponential backoff and full jitter, and at most retry_budget retries per run.
+    Requests answered 429 are paused and tried again up to max_throttle_pauses
+    times each, without using the retry budget.
+    """
+
+    def __init__(
+        self,
+        max_attempts=MAX_ATTEMPTS,
+        retry_budget=RETRY_BUDGET,
+        backoff_base=0.5,
+        backoff_max=30,
+        max_throttle_pauses=MAX_THROTTLE_PAUSES,
+    ):
+        self.max_attempts = max_attempts
+        self.retry_budget = retry_budget
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_throttle_pauses = max_throttle_pauses
+        self.retries = 0
+
+    def get_backoff(self, attempt):
+        """
+        Get how long to wait before retrying after the given failed attempt.
+        """
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        )
+
+    def use_retry(self):
+        """
+        Take a retry from the run's budget. Returns False if it is used up.
+        """
+        if self.retries >= self.retry_budget:
+            return False
+        self.retries += 1
+        return True
+
+
+class RequestLimiter:
+    """
+    Async context manager that every TMDB request runs in. Caps the number of
+    requests in flight, spaces them out to at most requests_per_second using a
+    token bucket, and raises RequestBudgetExhausted once max_requests have started
+    or the deadline (a time.monotonic() time) has passed.
+
+    The rate adapts to TMDB: when it answers 429, all requests pause for the
+    Retry-After period and the rate is halved, then it climbs back towards
+    requests_per_second as requests succeed. Failed requests are retried according
+    to retry_policy.
+    """
+
+    def __init__(
+        self,
+        concurrency,
+        requests_per_second=None,
+        max_requests=None,
+        retry_policy=None,
+        deadline=None,
+    ):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.requests_per_second = requests_per_second
+        self.rate = requests_per_second
+        self.max_requests = max_requests
+        self.deadline = deadline
+        self.requests = 0
+        self.tokens = 1
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+
+    async def __aenter__(self):
+        self.check_budget()
+        await self.semaphore.acquire()
+        try:
+            await self.wait_for_token()
+            self.check_budget()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.requests += 1
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+    def check_budget(self):
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            raise RequestBudgetExhausted()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise RequestBudgetExhausted()
+
+    async def wait_for_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if not self.rate:
+                return
+            self.tokens = min(
+                max(1, self.rate), self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def throttle(self, retry_after):
+        """
+        Pause every request for retry_after seconds and halve the request rate.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self.tokens = 0
+        if self.rate:
+            self.rate = max(self.requests_per_second / 16, self.rate / 2)
+
+    def record_success(self):
+        """
+        Let the request rate recover towards requests_per_second.
+        """
+        if self.rate and self.rate < self.requests_per_second:
+            self.rate = min(
+                self.requests_per_second, self.rate + self.requests_per_second / 100
+            )
+
+
+async def get_media_from_tmdb_async(
+    api_key,
+    media,
+    cache_key,
+    session,
+    limiter,
+    stats=None,
+    base_url=tmdb_api_url,
+    title_index=None,
+):
+    """
+    Async: Resolve a movie/show to its TMDB ID by title and optional year, from
+    title_index if it has the title or else by searching TMDB. Returns a
+    resolution entry, or a negative entry if nothing was found, and the details
+    the search result has for the movie/show (None if there was no search result).
+
+    The exports have no years, so a title_index match for media with a year is
+    only used once the details lookup confirms the year, and those full details
+    are returned. Otherwise TMDB is searched. A match for media without a year
+    is marked with tmdbResolvedFrom 'export' and must not be cached, so it is
+    never mistaken for a verified resolution.
     """
     title = media["title"]
     year = media.get("year")
-    search_results = await query_tmdb_async(api_key, media, session, semaphore)
+    tmdb_id = title_index.get(media) if title_index is not None else None
+    if tmdb_id is not None and not year:
+        print(f"Resolved '{title}' to TMDB ID {tmdb_id} from the TMDB ID export")
+        if stats is not None:
+            stats["export_resolved"] += 1
+        resolution = {"cacheKey": cache_key, "tmdbID": tmdb_id, "tmdbStatus": "found"}
+        return {**resolution, "tmdbResolvedFrom": "export"}, None
+    if tmdb_id is not None:
+        details = await get_media_details_from_tmdb_async(
+            api_key,
+            media["mediaType"],
+            tmdb_id,
+            session,
+            limiter,
+            stats=stats,
+            base_url=base_url,
+        )
+        if details and details["year"] == str(year):
+            print(
+                f"Resolved '{title}' ({year}) to TMDB ID {tmdb_id} "
+                "from the TMDB ID export"
+            )
+            if stats is not None:
+                stats["export_resolved"] += 1
+            resolution = {
+                "cacheKey": cache_key,
+                "tmdbID": tmdb_id,
+                "tmdbStatus": "found",
+            }
+            return resolution, details
+        print(
+            f"TMDB ID export match {tmdb_id} for '{title}' is not from {year}, "
+            "searching TMDB instead"
+        )
+
+    search_results = await query_tmdb_async(
+        api_key, media, session, limiter, stats=stats, base_url=base_url
+    )
+    if search_results is None:
+        return get_negative_media(media, cache_key, "failed"), None
     if not search_results:
         print(f"No TMDB results found for '{title}' ({year}) {media['mediaType']}")
-        return {
-            "cacheKey": cache_key,
-            "title": title,
-            "year": year,
-            "tmdbPopularity": 0,
-            "tmdbRating": 0,
-            "tmdbRatingCount": 0,
-            "imdbID": None,
-        }
+        return get_negative_media(media, cache_key, "not-found"), None
 
     # Use the first search result
-    tmdb_id = search_results[0]["id"]
+    resolution = {
+        "cacheKey": cache_key,
+        "tmdbID": search_results[0]["id"],
+        "tmdbStatus": "found",
+    }
+    return resolution, get_search_details(media["mediaType"], search_results[0])
+
+
+async def get_media_details_from_tmdb_async(
+    api_key, media_type, tmdb_id, session, limiter, stats=None, base_url=tmdb_api_url
+):
+    """
+    Async: Get TMDB movie/show details by TMDB ID. Returns None if the lookup failed.
+    """
     tmdb_media = await lookup_tmdb_async(
-        api_key, media["mediaType"], tmdb_id, session, semaphore
+        api_key, media_type, tmdb_id, session, limiter, stats=stats, base_url=base_url
     )
     if not tmdb_media:
-        return {
-            "cacheKey": cache_key,
-            "title": title,
-            "year": year,
-            "tmdbPopularity": 0,
-            "tmdbRating": 0,
-            "tmdbRatingCount": 0,
-            "imdbID": None,
-        }
+        return None
     return {
-        "cacheKey": cache_key,
-        "title": (
-            tmdb_media["title"] if media["mediaType"] == "movie" else tmdb_media["name"]
-        ),
-        "year": (
-            tmdb_media["release_date"][:4] if tmdb_media.get("release_date") else None
-        ),
+        "cacheKey": get_details_key(media_type, tmdb_id),
+        "tmdbID": tmdb_id,
+        "title": tmdb_media["title"] if media_type == "movie" else tmdb_media["name"],
+        "year": get_release_year(media_type, tmdb_media),
         "tmdbPopularity": tmdb_media["popularity"],
         "tmdbRating": tmdb_media["vote_average"],
         "tmdbRatingCount": tmdb_media["vote_count"],
         "imdbID": tmdb_media.get("imdb_id", None),
+        "tmdbStatus": "found",
+    }
+
+
+def get_search_details(media_type, search_result):
+    """
+    Build a TMDB details entry from a search result. Search results have no IMDb
+    ID, so unlike the entries built from a details lookup this has no imdbID.
+    """
+    return {
+        "cacheKey": get_details_key(media_type, search_result["id"]),
+        "tmdbID": search_result["id"],
+        "title": search_result.get("title" if media_type == "movie" else "name"),
+        "year": get_release_year(media_type, search_result),
+        "tmdbPopularity": search_result.get("popularity", 0),
+        "tmdbRating": search_result.get("vote_average", 0),
+        "tmdbRatingCount": search_result.get("vote_count", 0),
+        "tmdbStatus": "found",
+    }
+
+
+def get_release_year(media_type, tmdb_media):
+    """
+    Get the year a movie was released or a show first aired from TMDB data.
+    """
+    date = tmdb_media.get("release_date" if media_type == "movie" else "first_air_date")
+    return date[:4] if date else None
+
+
+def get_negative_media(media, cache_key, status):
+    """
+    Build a zeroed TMDB entry for a media item that was not found ('not-found')
+    or could not be looked up ('failed').
+    """
+    return {
+        "cacheKey": cache_key,
+        "title": media["title"],
+        "year": media.get("year"),
+        "tmdbPopularity": 0,
+        "tmdbRating": 0,
+        "tmdbRatingCount": 0,
+        "imdbID": None,
+        "tmdbStatus": status,
     }
 
 
-async def query_tmdb_async(api_key, media, session, semaphore):
+async def query_tmdb_async(
+    api_key, media, session, limiter, stats=None, base_url=tmdb_api_url
+):
     """
     Async: Query TMDB for movies/shows by title and optional year.
+    Returns None if the request failed.
     """
     title = media["title"]
     media_type = media["mediaType"]
-    if media_type not in ["movie", "show"]:
+    if media_type not in tmdb_media_types:
         print(f"Unknown media type '{media_type}' for item '{title}'")
         return []
     year = media.get("year")
@@ -144,30 +936,116 @@ async def query_tmdb_async(api_key, media, session, semaphore):
     if year:
         params["year"] = year
 
-    url = tmdb_movie_search_url if media_type == "movie" else tmdb_show_search_url
-    async with semaphore:
-        async with session.get(url, params=params) as resp:
-            if resp.status != 200:
-                print(f"TMDB search failed for '{title}': {resp.status}")
-                return []
-            data = await resp.json()
-            return data.get("results", [])
+    url = f"{base_url}/search/{tmdb_media_types[media_type]}"
+    status, data = await get_tmdb_json_async(url, params, session, limiter, stats)
+    if status != 200:
+        print(f"TMDB search failed for '{title}': {status}")
+        return None
+    return data.get("results", [])
 
 
-async def lookup_tmdb_async(api_key, media_type, tmdb_id, session, semaphore):
+async def lookup_tmdb_async(
+    api_key, media_type, tmdb_id, session, limiter, stats=None, base_url=tmdb_api_url
+):
     """
     Async: Lookup a movie/show by its TMDB ID.
     """
-    url = tmdb_movie_lookup_url if media_type == "movie" else tmdb_show_lookup_url
-    url += f"/{tmdb_id}"
+    url = f"{base_url}/{tmdb_media_types[media_type]}/{tmdb_id}"
 
     print(f"Looking up TMDB ID {tmdb_id} at URL {url}...")
-    async with semaphore:
-        async with session.get(url, params={"api_key": api_key}) as resp:
-            if resp.status != 200:
-                print(f"TMDB lookup failed for ID {tmdb_id}: {resp.status}")
-                return None
-            return await resp.json()
+    params = {"api_key": api_key}
+    status, data = await get_tmdb_json_async(url, params, session, limiter, stats)
+    if status != 200:
+        print(f"TMDB lookup failed for ID {tmdb_id}: {status}")
+        return None
+    return data
+
+
+async def get_tmdb_json_async(url, params, session, limiter, stats=None):
+    """
+    Async: GET a TMDB API URL within the request limiter. When TMDB responds with
+    429 Too Many Requests, every request is paused for the Retry-After period and
+    the request is tried again, up to the retry policy's max_throttle_pauses times.
+    Server errors, timeouts and connection errors are retried with backoff
+    according to the limiter's retry policy and its retry budget. Returns the
+    response status (None if no response was received) and, on success, the
+    parsed JSON body.
+    """
+    retry_policy = limiter.retry_policy
+    connect_timeout, read_timeout = get_http_timeout()
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    attempt = 1
+    throttle_pauses = 0
+    while True:
+        try:
+            async with limiter:
+                count_request(stats)
+                async with session.get(
+                    url, params=params, timeout=timeout, trace_request_ctx=stats
+                ) as resp:
+                    status = resp.status
+                    if status != 429:
+                        limiter.record_success()
+                    if status == 200:
+                        return status, await resp.json()
+                    retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            error = f"HTTP {status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status = None
+            error = repr(e)
+
+        if status == 429:
+            # Retry-After already bounds the cost, so 429s leave the retry budget alone
+            if throttle_pauses >= retry_policy.max_throttle_pauses:
+                return status, None
+            throttle_pauses += 1
+            print(f"TMDB rate limit hit, pausing requests for {retry_after}s")
+            count_retry(stats, "throttled")
+            limiter.throttle(retry_after)
+            continue
+        if not is_retryable(status) or attempt >= retry_policy.max_attempts:
+            return status, None
+        if not retry_policy.use_retry():
+            return status, None
+        delay = retry_policy.get_backoff(attempt)
+        print(f"TMDB request failed ({error}), retrying in {delay:.1f}s...")
+        count_retry(stats, "retries")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def is_retryable(status):
+    """
+    Check whether a failed request is worth retrying: no response at all (timeout
+    or connection error) or a server error.
+    """
+    return status is None or status >= 500
+
+
+def parse_retry_after(value, default=1.0):
+    """
+    Parse a Retry-After header given in seconds, falling back to default.
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return default
+
+
+def count_retry(stats, counter):
+    """
+    Count a retried TMDB API request in the given stats counter, if any.
+    """
+    if stats is not None:
+        stats[counter] += 1
+
+
+def count_request(stats):
+    """
+    Count a TMDB API request in the given stats counter, if any.
+    """
+    if stats is not None:
+        stats["requests"] += 1
 
 
 # Sample TMDB TV show data structure from the API:
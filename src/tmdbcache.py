@@ -0,0 +1,620 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from binarycache import BinaryCacheReader, write_binary_cache
+from utils import create_dir_if_not_exists, read_json_file, save_to_json_file
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows, where caches are not locked
+    fcntl = None
+
+# Storage backends for cached TMDB data. Every backend stores TMDB entries
+# (dicts with a 'cacheKey') and exposes the same get/put/close interface.
+
+JSON_CACHE_FILE = "cache/tmdb.json"
+SQLITE_CACHE_FILE = "cache/tmdb.db"
+BINARY_CACHE_FILE = "cache/tmdb.bin"
+JOURNAL_COMPACT_BYTES = 1024 * 1024  # Fold a cache journal in once it is this big
+
+
+class JsonCache:
+    """
+    Cache backed by a JSON file that is loaded fully into memory. New entries are
+    appended to a journal file as they arrive and replayed on load, and the journal
+    is folded into the JSON file once it grows past JOURNAL_COMPACT_BYTES.
+    """
+
+    in_memory = True  # Every entry is in self.entries, so scanning them is cheap
+
+    def __init__(self, filename=JSON_CACHE_FILE):
+        self.filename = filename
+        self.journal_filename = filename + ".journal"
+        self.journal = None
+        # Other processes may use the same cache. Appends and compaction hold an
+        # exclusive lock on the lock file, which counts the compactions so far.
+        create_dir_if_not_exists(os.path.dirname(filename) or ".")
+        self.lock_file = open(filename + ".lock", "a+", encoding="utf-8")
+        self.lock(shared=True)
+        try:
+            self.load()
+        finally:
+            self.unlock()
+
+    def load(self):
+        """
+        Load the JSON file and replay the journal on top of it.
+        """
+        self.generation = self.read_generation()
+        entries = load_json_cache(self.filename)
+        # Later entries win if the file contains the same key more than once
+        self.entries = {m["cacheKey"]: m for m in entries}
+        self.removed = set()
+        self.journal_size, replayed = self.replay_journal()
+        self.journal_loaded_size = self.journal_size
+        self.stored_count = len(entries) + replayed
+
+    def replay_journal(self, start=0):
+        return replay_journal(self.journal_filename, self.entries, start=start)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, cache_key):
+        """
+        Lookup an entry in the cache using the cache key.
+        """
+        return self.entries.get(cache_key)
+
+    def items(self):
+        """
+        Iterate over every entry in the cache.
+        """
+        return iter(list(self.entries.values()))
+
+    def put(self, tmdb_media):
+        """
+        Add or replace an entry in the cache, keyed by its cache key, and append it
+        to the journal straight away.
+        """
+        self.removed.discard(tmdb_media["cacheKey"])
+        self.entries[tmdb_media["cacheKey"]] = tmdb_media
+        self.append_to_journal(tmdb_media)
+
+    def touch(self, cache_key, accessed_at):
+        """
+        Record when an entry was last used, for eviction by age.
+        """
+        tmdb_media = self.get(cache_key)
+        if tmdb_media is not None:
+            tmdb_media["lastAccessed"] = accessed_at
+            self.entries[cache_key] = tmdb_media
+            self.append_to_journal({"touch": cache_key, "lastAccessed": accessed_at})
+
+    def remove(self, cache_keys):
+        """
+        Remove entries from the cache. Takes effect on disk at the next compaction.
+        """
+        for cache_key in cache_keys:
+            self.entries.pop(cache_key, None)
+            self.removed.add(cache_key)
+
+    def append_to_journal(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self.lock()
+        try:
+            # The journal this process has open is gone once another process has
+            # folded it in, so the next line goes to a new journal
+            generation = self.read_generation()
+            if self.journal is not None and generation != self.journal_generation:
+                self.close_journal()
+            if self.journal is None:
+                self.journal = open(self.journal_filename, "a", encoding="utf-8")
+                self.journal_generation = generation
+            self.journal.write(line)
+            self.journal.flush()
+            self.journal_size = os.fstat(self.journal.fileno()).st_size
+        finally:
+            self.unlock()
+
+    def close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def lock(self, shared=False):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def read_generation(self):
+        """
+        Get the number of times the cache has been compacted, from the lock file.
+        """
+        self.lock_file.seek(0)
+        return int(self.lock_file.read() or 0)
+
+    def write_generation(self, generation):
+        self.lock_file.seek(0)
+        self.lock_file.truncate()
+        self.lock_file.write(str(generation))
+        self.lock_file.flush()
+        self.generation = generation
+
+    def catch_up(self):
+        """
+        Apply what other processes wrote to the cache since it was loaded: the rest
+        of the journal, or the whole cache again if they compacted it meanwhile.
+        Entries removed in this process stay removed. Called with the lock held.
+        """
+        if self.read_generation() == self.generation:
+            self.replay_journal(self.journal_loaded_size)
+            return
+        removed = self.removed
+        self.load()
+        self.remove(removed)
+
+    def disk_size(self):
+        """
+        Get the number of bytes the cache takes up on disk.
+        """
+        return get_file_size(self.filename) + get_file_size(self.journal_filename)
+
+    def compact(self):
+        """
+        Rewrite the JSON file in compact form with every entry and empty the journal.
+        """
+        self.lock()
+        try:
+            self.close_journal()
+            self.catch_up()
+            temp_filename = self.filename + ".tmp"
+            save_to_json_file(list(self.entries.values()), temp_filename, indent=None)
+            self.fold_journal(temp_filename)
+            self.stored_count = len(self.entries)
+        finally:
+            self.unlock()
+
+    def fold_journal(self, temp_filename):
+        """
+        Replace the cache file with the rewritten one and delete the journal folded
+        into it. Called with the lock held.
+        """
+        os.replace(temp_filename, self.filename)
+        if os.path.exists(self.journal_filename):
+            os.remove(self.journal_filename)
+        self.write_generation(self.generation + 1)
+        print(f"Compacted {self.journal_size} journal bytes into {self.filename}")
+        self.journal_size = 0
+        self.journal_loaded_size = 0
+        self.removed = set()
+
+    def close(self):
+        """
+        Close the journal, compacting it first if it has grown too large.
+        """
+        if self.journal_size >= JOURNAL_COMPACT_BYTES:
+            self.compact()
+        self.close_journal()
+        self.lock_file.close()
+
+
+class BinaryCache(JsonCache):
+    """
+    Cache backed by a memory-mapped binary file (see binarycache.py), so opening
+    it does not decode anything and a lookup only reads the pages it needs. New
+    entries are kept in memory and journaled like JsonCache, and folded into a
+    rewritten binary file once the journal grows past JOURNAL_COMPACT_BYTES.
+    """
+
+    in_memory = False
+
+    def __init__(self, filename=BINARY_CACHE_FILE):
+        self.reader = None
+        super().__init__(filename)
+
+    def load(self):
+        """
+        Memory-map the binary file and replay the journal on top of it.
+        """
+        self.generation = self.read_generation()
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = open_binary_cache(self.filename)
+        self.entries = {}
+        self.removed = set()
+        self.journal_size, replayed = self.replay_journal()
+        self.journal_loaded_size = self.journal_size
+        self.stored_count = len(self.reader or []) + replayed
+
+    def replay_journal(self, start=0):
+        return replay_journal(
+            self.journal_filename,
+            self.entries,
+            self.reader.get if self.reader else None,
+            start=start,
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def get(self, cache_key):
+        """
+        Lookup an entry in the cache using the cache key.
+        """
+        if cache_key in self.entries:
+            return self.entries[cache_key]
+        if self.reader is None or cache_key in self.removed:
+            return None
+        return self.reader.get(cache_key)
+
+    def items(self):
+        """
+        Iterate over every entry in the cache.
+        """
+        if self.reader is not None:
+            for tmdb_media in self.reader.items():
+                cache_key = tmdb_media["cacheKey"]
+                if cache_key not in self.entries and cache_key not in self.removed:
+                    yield tmdb_media
+        yield from list(self.entries.values())
+
+    def compact(self):
+        """
+        Rewrite the binary file with every entry and empty the journal.
+        """
+        self.lock()
+        try:
+            self.close_journal()
+            self.catch_up()
+            entries = list(self.items())
+            temp_filename = self.filename + ".tmp"
+            write_binary_cache(entries, temp_filename)
+            if self.reader is not None:
+                self.reader.close()
+            self.fold_journal(temp_filename)
+            self.reader = open_binary_cache(self.filename)
+            self.entries = {}
+            self.stored_count = len(entries)
+        finally:
+            self.unlock()
+
+    def close(self):
+        """
+        Close the journal, compacting it first if it has grown too large, and
+        unmap the binary file.
+        """
+        super().close()
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+
+
+class SqliteCache:
+    """
+    Cache backed by an SQLite database in WAL mode. Entries are read and written
+    one row at a time, so a run only touches the rows it needs.
+    """
+
+    in_memory = False
+
+    def __init__(self, filename=SQLITE_CACHE_FILE):
+        create_dir_if_not_exists(os.path.dirname(filename) or ".")
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tmdb_cache ("
+            "cache_key TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+        print(f"Opened SQLite cache {filename}")
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM tmdb_cache").fetchone()[0]
+
+    def get(self, cache_key):
+        """
+        Lookup an entry in the cache using the cache key.
+        """
+        row = self.connection.execute(
+            "SELECT data FROM tmdb_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def items(self):
+        """
+        Iterate over every entry in the cache.
+        """
+        for (data,) in self.connection.execute("SELECT data FROM tmdb_cache"):
+            yield json.loads(data)
+
+    def put(self, tmdb_media):
+        """
+        Add or replace an entry in the cache, keyed by its cache key.
+        """
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tmdb_cache (cache_key, data) VALUES (?, ?)",
+                (tmdb_media["cacheKey"], json.dumps(tmdb_media, ensure_ascii=False)),
+            )
+
+    def touch(self, cache_key, accessed_at):
+        """
+        Record when an entry was last used, for eviction by age.
+        """
+        with self.connection:
+            self.connection.execute(
+                "UPDATE tmdb_cache SET data = json_set(data, '$.lastAccessed', ?) "
+                "WHERE cache_key = ?",
+                (accessed_at, cache_key),
+            )
+
+    def remove(self, cache_keys):
+        """
+        Remove entries from the cache.
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM tmdb_cache WHERE cache_key = ?",
+                ((cache_key,) for cache_key in cache_keys),
+            )
+
+    @property
+    def stored_count(self):
+        return len(self)
+
+    def disk_size(self):
+        """
+        Get the number of bytes the cache takes up on disk, including the WAL file.
+        """
+        return get_file_size(self.filename) + get_file_size(self.filename + "-wal")
+
+    def compact(self):
+        """
+        Rebuild the database without free pages and fold the WAL file into it.
+        """
+        self.connection.execute("VACUUM")
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        self.connection.close()
+
+
+cache_backends = {
+    "json": JsonCache,
+    "sqlite": SqliteCache,
+    "binary": BinaryCache,
+}
+
+
+def open_cache(backend="json"):
+    """
+    Open the TMDB cache using the given backend.
+    """
+    if backend not in cache_backends:
+        raise ValueError(
+            f"Invalid cache backend '{backend}'. Must be one of {list(cache_backends.keys())}."
+        )
+    return cache_backends[backend]()
+
+
+def is_stale(tmdb_media, ttl, now=None):
+    """
+    Check whether a cached entry is older than ttl seconds. Entries cached
+    before timestamps were recorded are always stale.
+    """
+    now = time.time() if now is None else now
+    return now - tmdb_media.get("cachedAt", 0) > ttl
+
+
+def load_json_cache(filename):
+    """
+    Load the list of cached TMDB entries from a JSON file.
+    """
+    try:
+        entries = read_json_file(filename)
+        print(f"Loaded {len(entries)} items from cache")
+        return entries
+    except FileNotFoundError:
+        print("Cache file not found, starting with empty cache")
+        return []
+
+
+def open_binary_cache(filename):
+    """
+    Memory-map a binary cache file, or return None if it does not exist.
+    """
+    try:
+        reader = BinaryCacheReader(filename)
+        print(f"Opened binary cache with {len(reader)} items")
+        return reader
+    except FileNotFoundError:
+        print("Cache file not found, starting with empty cache")
+        return None
+
+
+def replay_journal(filename, entries, lookup=None, start=0):
+    """
+    Apply the entries and touches appended to a journal file from byte offset start
+    on top of the loaded cache. A partially written last line, e.g. from a crash, is
+    dropped from the file. Touched entries missing from entries are fetched with
+    lookup, if given. Returns the size of the journal in bytes and the number of
+    lines replayed.
+    """
+    try:
+        with open(filename, "rb") as f:
+            f.seek(start)
+            lines = f.readlines()
+    except FileNotFoundError:
+        return 0, 0
+
+    size = start + sum(len(line) for line in lines)
+    if lines and not lines[-1].endswith(b"\n"):
+        print(f"Dropping partially written last line of {filename}")
+        size -= len(lines.pop())
+        os.truncate(filename, size)
+
+    replayed = 0
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            print(f"Skipping corrupt line in {filename}")
+            continue
+        if "touch" in record:
+            cache_key = record["touch"]
+            if cache_key not in entries and lookup is not None:
+                tmdb_media = lookup(cache_key)
+                if tmdb_media is not None:
+                    entries[cache_key] = tmdb_media
+            if cache_key in entries:
+                entries[cache_key]["lastAccessed"] = record["lastAccessed"]
+        else:
+            entries[record["cacheKey"]] = record
+        replayed += 1
+    print(f"Replayed {replayed} items from cache journal")
+    return size, replayed
+
+
+def get_file_size(filename):
+    """
+    Get the size of a file in bytes, or 0 if it does not exist.
+    """
+    try:
+        return os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+
+
+def get_last_accessed(tmdb_media):
+    """
+    Get when an entry was last used, falling back to when it was cached.
+    Entries from before either was recorded count as never used.
+    """
+    return tmdb_media.get("lastAccessed", tmdb_media.get("cachedAt", 0))
+
+
+def compact_cache(backend="json", max_age_days=None, max_entries=None):
+    """
+    Drop duplicate entries, evict entries not used for max_age_days and then the
+    least recently used entries beyond max_entries, and rewrite the cache in
+    compact form. Prints the entries and bytes reclaimed.
+    """
+    cache = open_cache(backend)
+    size_before = cache.disk_size()
+    stored_before = cache.stored_count
+
+    entries = sorted(cache.items(), key=get_last_accessed, reverse=True)
+    keep = len(entries)
+    if max_age_days is not None:
+        cutoff = time.time() - max_age_days * 86400
+        keep = sum(1 for m in entries if get_last_accessed(m) >= cutoff)
+    if max_entries is not None:
+        keep = min(keep, max_entries)
+    cache.remove([m["cacheKey"] for m in entries[keep:]])
+    cache.compact()
+    size_after = cache.disk_size()
+    cache.close()
+
+    print(
+        f"Compacted cache from {stored_before} to {keep} entries "
+        f"({stored_before - keep} reclaimed, {len(entries) - keep} evicted) "
+        f"and from {size_before} to {size_after} bytes "
+        f"({size_before - size_after} reclaimed)"
+    )
+
+
+def convert_cache(source_filename, target_filename):
+    """
+    Convert a cache file between the JSON and binary formats. The format of each
+    file is taken from its extension ('.json' or '.bin').
+    """
+    caches = {".json": JsonCache, ".bin": BinaryCache}
+    source_format = os.path.splitext(source_filename)[1]
+    target_format = os.path.splitext(target_filename)[1]
+    if source_format not in caches or target_format not in caches:
+        raise ValueError(
+            f"Cannot convert '{source_filename}' to '{target_filename}'. "
+            f"Both must end in one of {list(caches.keys())}."
+        )
+    source = caches[source_format](source_filename)
+    entries = list(source.items())
+    source.close()
+    create_dir_if_not_exists(os.path.dirname(target_filename) or ".")
+    if target_format == ".bin":
+        write_binary_cache(entries, target_filename)
+    else:
+        save_to_json_file(entries, target_filename, indent=None)
+    print(f"Converted {len(entries)} items from {source_filename} to {target_filename}")
+
+
+def import_json_cache(json_filename=JSON_CACHE_FILE, db_filename=SQLITE_CACHE_FILE):
+    """
+    Copy every entry of a JSON cache file into an SQLite cache in one transaction.
+    """
+    entries = JsonCache(json_filename).entries
+    cache = SqliteCache(db_filename)
+    with cache.connection:
+        cache.connection.executemany(
+            "INSERT OR REPLACE INTO tmdb_cache (cache_key, data) VALUES (?, ?)",
+            (
+                (key, json.dumps(entry, ensure_ascii=False))
+                for key, entry in entries.items()
+            ),
+        )
+    print(f"Imported {len(entries)} items into {db_filename}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TMDB cache maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser(
+        "import", help="Import a JSON cache file into the SQLite cache."
+    )
+    import_parser.add_argument("--json-file", default=JSON_CACHE_FILE)
+    import_parser.add_argument("--db-file", default=SQLITE_CACHE_FILE)
+
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Convert a cache file between the JSON ('.json') and binary ('.bin') formats.",
+    )
+    convert_parser.add_argument("source_file")
+    convert_parser.add_argument("target_file")
+
+    compact_parser = subparsers.add_parser(
+        "compact",
+        help="Drop duplicate and unused entries and rewrite the cache in compact form.",
+    )
+    compact_parser.add_argument(
+        "--backend", choices=list(cache_backends.keys()), default="json"
+    )
+    compact_parser.add_argument(
+        "--max-age-days",
+        type=float,
+        help="Evict entries that have not been used for this many days.",
+    )
+    compact_parser.add_argument(
+        "--max-entries",
+        type=int,
+        help="Keep at most this many entries, evicting the least recently used.",
+    )
+
+    args = parser.parse_args()
+    if args.command == "import":
+        import_json_cache(args.json_file, args.db_file)
+    elif args.command == "convert":
+        convert_cache(args.source_file, args.target_file)
+    elif args.command == "compact":
+        compact_cache(args.backend, args.max_age_days, args.max_entries)
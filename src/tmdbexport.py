@@ -0,0 +1,207 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from tmdb import normalize_title
+
+# Offline title resolution from the daily TMDB ID exports
+# (https://developer.themoviedb.org/docs/daily-id-exports), so a cold run can skip
+# the search request for titles the export resolves on its own.
+#
+# An export is a gzipped file of one JSON object per line with the TMDB ID, the
+# original title and the popularity of a movie or TV series. It is turned into an
+# index of 64-bit hashes of normalized titles, sorted, with the TMDB ID of each.
+# Exports have no release years, so a title is only indexed when one movie/show
+# with it is at least MIN_POPULARITY_RATIO times as popular as any other.
+#
+# Index layout (little-endian):
+#   header          magic, entry count
+#   hashes          one u64 per entry, sorted
+#   ids             one u32 per entry, the TMDB ID for the hash at the same position
+
+MAGIC = b"TMDBIDX1"
+HEADER = struct.Struct("<8sQ")
+TITLE_INDEX_FILES = {
+    "movie": "cache/tmdb-movie-ids.idx",
+    "show": "cache/tmdb-tv-ids.idx",
+}
+MIN_POPULARITY_RATIO = 10  # How much more popular the indexed movie/show must be than others with its title
+export_prefixes = {"movie_ids_": "movie", "tv_series_ids_": "show"}
+
+
+class TitleIndex:
+    """
+    Lookup TMDB IDs by title in the indexes built from the TMDB ID exports. Media
+    types without an index file are never resolved.
+    """
+
+    def __init__(self, filenames=TITLE_INDEX_FILES):
+        self.indexes = {
+            media_type: read_title_index(filename)
+            for media_type, filename in filenames.items()
+            if os.path.exists(filename)
+        }
+
+    def __len__(self):
+        return sum(len(hashes) for hashes, _ in self.indexes.values())
+
+    def get(self, media):
+        """
+        Lookup the TMDB ID of a media item by its type and title. Returns None if
+        the title is not in the index.
+        """
+        if media["mediaType"] not in self.indexes:
+            return None
+        hashes, ids = self.indexes[media["mediaType"]]
+        title_hash = hash_title(normalize_title(media["title"]))
+        i = bisect_left(hashes, title_hash)
+        if i < len(hashes) and hashes[i] == title_hash:
+            return ids[i]
+        return None
+
+
+def open_title_index():
+    """
+    Open the title indexes built from the TMDB ID exports, or return None if none
+    have been built.
+    """
+    title_index = TitleIndex()
+    if not len(title_index):
+        return None
+    print(f"Loaded {len(title_index)} titles from the TMDB ID export indexes")
+    return title_index
+
+
+def hash_title(title):
+    """
+    Hash a normalized title to a 64-bit integer.
+    """
+    digest = hashlib.blake2b(title.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def read_export(filename):
+    """
+    Read a TMDB ID export, gzipped or not, yielding the TMDB ID, title and
+    popularity of every movie/show in it. Adult titles are left out.
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("adult"):
+                continue
+            title = item.get("original_title") or item.get("original_name")
+            if title:
+                yield item["id"], title, item.get("popularity") or 0
+
+
+def build_title_index(export_filename, index_filename):
+    """
+    Build a title index from a TMDB ID export. Titles shared by several movies or
+    shows are only indexed if one of them is at least MIN_POPULARITY_RATIO times
+    as popular as the rest.
+    """
+    best = {}  # Normalized title -> (popularity, TMDB ID, next best popularity)
+    count = 0
+    for tmdb_id, title, popularity in read_export(export_filename):
+        count += 1
+        title = normalize_title(title)
+        if title not in best:
+            best[title] = (popularity, tmdb_id, None)
+            continue
+        best_popularity, best_id, next_popularity = best[title]
+        if popularity > best_popularity:
+            best[title] = (popularity, tmdb_id, best_popularity)
+        elif next_popularity is None or popularity > next_popularity:
+            best[title] = (best_popularity, best_id, popularity)
+
+    entries = sorted(
+        (hash_title(title), tmdb_id)
+        for title, (popularity, tmdb_id, next_popularity) in best.items()
+        if next_popularity is None
+        or popularity >= MIN_POPULARITY_RATIO * next_popularity
+    )
+    write_title_index(entries, index_filename)
+    print(
+        f"Indexed {len(entries)} of {len(best)} titles from {count} entries in "
+        f"'{export_filename}' to '{index_filename}'"
+    )
+
+
+def write_title_index(entries, filename):
+    """
+    Write a list of (title hash, TMDB ID) pairs, sorted by hash, to an index file.
+    """
+    hashes = array("Q", (title_hash for title_hash, _ in entries))
+    ids = array("I", (tmdb_id for _, tmdb_id in entries))
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(entries)))
+        for data in [hashes, ids]:
+            if sys.byteorder != "little":
+                data.byteswap()
+            data.tofile(f)
+
+
+def read_title_index(filename):
+    """
+    Read an index file. Returns its sorted title hashes and matching TMDB IDs.
+    """
+    with open(filename, "rb") as f:
+        magic, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"'{filename}' is not a TMDB title index file")
+        hashes = array("Q")
+        hashes.fromfile(f, count)
+        ids = array("I")
+        ids.fromfile(f, count)
+    if sys.byteorder != "little":
+        hashes.byteswap()
+        ids.byteswap()
+    return hashes, ids
+
+
+def get_export_media_type(filename):
+    """
+    Tell the media type of a TMDB ID export from its file name, e.g.
+    movie_ids_10_17_2026.json.gz or tv_series_ids_10_17_2026.json.gz.
+    """
+    name = os.path.basename(filename)
+    for prefix, media_type in export_prefixes.items():
+        if name.startswith(prefix):
+            return media_type
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build title indexes from TMDB daily ID exports"
+    )
+    parser.add_argument(
+        "exports",
+        nargs="+",
+        help="Downloaded TMDB ID export files, e.g. movie_ids_10_17_2026.json.gz "
+        "and tv_series_ids_10_17_2026.json.gz.",
+    )
+    parser.add_argument(
+        "--media-type",
+        choices=list(TITLE_INDEX_FILES.keys()),
+        help="The media type of the exports. By default it is taken from their file names.",
+    )
+    args = parser.parse_args()
+    for export_filename in args.exports:
+        media_type = args.media_type or get_export_media_type(export_filename)
+        if media_type is None:
+            parser.error(
+                f"Cannot tell the media type of '{export_filename}', use --media-type."
+            )
+        build_title_index(export_filename, TITLE_INDEX_FILES[media_type])
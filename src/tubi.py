@@ -1,5 +1,4 @@
-import requests
-
+import httpclient
 from utils import read_text_file
 
 
@@ -10,27 +9,46 @@ collection_urls = {
     "recently-added": "https://tensor-cdn.production-public.tubi.io/api/v7/containers/recently_added",
     "trending-now": "https://tensor-cdn.production-public.tubi.io/api/v7/containers/trending",
 }
+contents_limit = 200  # Media per page
 
 
 def get_tubi_media_list(access_token, collection="recently-added"):
     """
-    Fetch the list of media items from a Tubi collection.
+    Fetch the list of media items from a Tubi collection, following its cursor
+    until every page has been fetched.
 
     :param access_token: Tubi access token for authorization
     :param collection: Collection key from collection_urls
     :return: List of media items
     """
+    media_list = []
+    for page in iter_tubi_pages(access_token, collection):
+        media_list.extend(page)
+
+    print(f"Total media found from Tubi: {len(media_list)}")
+
+    return media_list
+
+
+def iter_tubi_pages(access_token, collection="recently-added"):
+    """
+    Fetch a Tubi collection page by page, following the container cursor until
+    there is no next page.
+
+    :param access_token: Tubi access token for authorization
+    :param collection: Collection key from collection_urls
+    :return: Generator of lists of media items, one per page
+    """
     url = collection_urls.get(collection)
     if not url:
         raise ValueError(f"Collection '{collection}' not found.")
 
     params = {
-        "contents_limit": 200,
+        "contents_limit": contents_limit,
         "cursor": 0,
     }
     headers = {
         "Accept": "*/*",
-        "Accept-Encoding": "gzip, deflate, br",
         "Accept-Language": "en-US",
         "Authorization": f"Bearer {access_token}",
         "Cache-Control": "no-cache",
@@ -41,34 +59,37 @@ def get_tubi_media_list(access_token, collection="recently-added"):
         "Sec-Fetch-Dest": "empty",
         "Sec-Fetch-Mode": "cors",
         "Sec-Fetch-Site": "cross-site",
-        "User-Agent": "Mozilla/5.0",
     }
 
-    res = requests.get(url, params=params, headers=headers)
-    res.raise_for_status()
+    while True:
+        print(f"Fetching Tubi '{collection}' from cursor {params['cursor']}...")
+        res = httpclient.get(url, params=params, headers=headers)
+        res.raise_for_status()
 
-    contents = res.json().get("contents", {})
+        data = res.json()
+        contents = data.get("contents", {})
+        yield [get_media(item) for item in contents.values()]
 
-    # save_to_json_file(res.json(), "output/tubi-api-response.json")
-    # return []
+        cursor = data.get("container", {}).get("cursor")
+        if not contents or cursor in (None, params["cursor"]):
+            break
+        params["cursor"] = cursor
 
-    is_show = lambda item: item["type"] == "s"
-    media_list = [
-        {
-            "mediaType": "show" if is_show(item) else "movie",
-            "title": item["title"],
-            "year": str(item.get("year")),
-            "tubiURL": "https://tubitv.com/"
-            + ("series" if is_show(item) else "movies")
-            + "/"
-            + item["id"],
-        }
-        for item in contents.values()
-    ]
-
-    print(f"Total media found from Tubi: {len(media_list)}")
 
-    return media_list
+def get_media(item):
+    """
+    Build a media item from a Tubi content item.
+    """
+    is_show = item["type"] == "s"
+    return {
+        "mediaType": "show" if is_show else "movie",
+        "title": item["title"],
+        "year": str(item.get("year")),
+        "tubiURL": "https://tubitv.com/"
+        + ("series" if is_show else "movies")
+        + "/"
+        + item["id"],
+    }
 
 
 if __name__ == "__main__":
@@ -1,5 +1,9 @@
 import json
 
+CONNECT_TIMEOUT = 10  # Seconds to wait for a connection to a server
+READ_TIMEOUT = 30  # Seconds to wait for a server to send data
+http_timeouts = {"connect": CONNECT_TIMEOUT, "read": READ_TIMEOUT}
+
 
 def create_dir_if_not_exists(directory):
     """
@@ -48,12 +52,34 @@ def read_json_file(filename):
         return json.load(f)
 
 
-def save_to_json_file(data, filename):
+def save_to_json_file(data, filename, indent=4):
     """
     Save a list of dictionaries to a JSON file.
 
     :param data: List of dictionaries to save
     :param filename: Name of the JSON file
+    :param indent: Indentation to pretty-print with, or None for compact output
     """
+    separators = (",", ":") if indent is None else None
     with open(filename, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+        json.dump(data, f, ensure_ascii=False, indent=indent, separators=separators)
+
+
+def set_http_timeouts(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT):
+    """
+    Set the timeouts used by every HTTP request.
+
+    :param connect: Seconds to wait for a connection to a server
+    :param read: Seconds to wait for a server to send data
+    """
+    http_timeouts["connect"] = connect
+    http_timeouts["read"] = read
+
+
+def get_http_timeout():
+    """
+    Get the timeouts to pass to requests as its timeout argument.
+
+    :return: Tuple of the connect and read timeouts in seconds
+    """
+    return http_timeouts["connect"], http_timeouts["read"]
@@ -0,0 +1,121 @@
+import argparse
+import os
+import sys
+
+from cli import iter_media_pages, media_sources
+from httpclient import print_connection_stats
+from tmdb import get_tmdb_media_list
+from tmdbexport import open_title_index
+from utils import read_text_file
+
+# Pre-fill the TMDB cache from the large "all" collections, outside the daily run,
+# so the daily run over the small "recently added" collections is mostly cache hits.
+# Runs at low priority and within a TMDB request budget and rate.
+
+warm_media_sources = [
+    "sbs-movies-all",
+    "sbs-shows-all",
+    "abc-movies-a-z",
+    *[source for source in media_sources if source.startswith("tubi-")],
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Movie Rating Checker cache warm-up")
+    parser.add_argument(
+        "media_sources",
+        nargs="*",
+        help="The media sources to crawl. Defaults to the full SBS and ABC movie and show "
+        "collections and every Tubi container.",
+    )
+    parser.add_argument(
+        "--tmdb-api-key",
+        type=str,
+        help="The TMDB API key. If not provided, it will be read from input/tmdb_api_key.txt.",
+    )
+    parser.add_argument(
+        "--max-requests",
+        type=int,
+        default=2000,
+        help="Maximum number of TMDB requests to make. Default is 2000.",
+    )
+    parser.add_argument(
+        "--requests-per-second",
+        type=float,
+        default=2,
+        help="Maximum TMDB requests per second. Default is 2.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Maximum concurrent TMDB requests. Default is 4.",
+    )
+    parser.add_argument(
+        "--refresh-budget",
+        type=int,
+        default=500,
+        help="Maximum number of stale cached TMDB entries to re-fetch, oldest first with "
+        "the JSON cache. Default is 500.",
+    )
+    parser.add_argument(
+        "--cache-backend",
+        choices=["json", "sqlite", "binary"],
+        default="json",
+        help="The TMDB cache to fill. Default is 'json'.",
+    )
+    args = parser.parse_args()
+    for source in args.media_sources:
+        if source not in media_sources:
+            parser.error(f"Invalid media source '{source}'.")
+
+    tmdb_api_key = args.tmdb_api_key or read_text_file("input/tmdb_api_key.txt").strip()
+    if not tmdb_api_key:
+        print(
+            "Error: TMDB API key is required. Provide it via --tmdb-api-key or in input/tmdb_api_key.txt"
+        )
+        sys.exit(1)
+
+    sources = args.media_sources or warm_media_sources
+    tubi_access_token = None
+    if any(source.startswith("tubi-") for source in sources):
+        if os.path.exists("input/tubi_access_token.txt"):
+            tubi_access_token = read_text_file("input/tubi_access_token.txt").strip()
+        if not tubi_access_token:
+            print("No Tubi access token in input/tubi_access_token.txt, skipping Tubi")
+            sources = [source for source in sources if not source.startswith("tubi-")]
+
+    # Stay out of the way of anything else running on the machine
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+    tmdb_media_list = get_tmdb_media_list(
+        tmdb_api_key,
+        iter_media(sources, tubi_access_token),
+        cache_backend=args.cache_backend,
+        refresh_budget=args.refresh_budget,
+        concurrency=args.concurrency,
+        requests_per_second=args.requests_per_second,
+        max_requests=args.max_requests,
+        title_index=open_title_index(),
+    )
+    print_connection_stats()
+    skipped = sum(1 for m in tmdb_media_list if m.get("tmdbStatus") == "skipped")
+    print(
+        f"Warmed cache for {len(tmdb_media_list) - skipped} of {len(tmdb_media_list)} media, "
+        f"{skipped} left for the next warm-up"
+    )
+
+
+def iter_media(sources, tubi_access_token=None):
+    """
+    Fetch the media of the media sources for enrichment. Media go to enrichment
+    page by page as they arrive, so Tubi containers are looked up while their
+    later pages are still downloading.
+    """
+    for _, page in iter_media_pages(sources, tubi_access_token):
+        yield from page or []
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import sys
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import tmdb  # noqa: E402
+from tmdbexport import TitleIndex, build_title_index  # noqa: E402
+
+FIXTURE_EXPORT = os.path.join(
+    os.path.dirname(__file__), "fixtures", "movie_ids_sample.json"
+)
+
+# TMDB movies in the fixture export, by ID: (title, release date)
+movies = {
+    438631: ("Dune", "2021-09-15"),
+    841: ("Dune", "1984-12-14"),
+    72190: ("The Host", "2013-03-22"),
+    1255: ("The Host", "2006-07-27"),
+}
+
+
+def create_tmdb_app():
+    """
+    Build a TMDB stand-in that searches and looks up the fixture movies.
+    """
+
+    async def search(request):
+        title, year = request.query["query"], request.query.get("year")
+        results = [
+            {"id": tmdb_id, "title": t, "release_date": date, "popularity": 1}
+            for tmdb_id, (t, date) in movies.items()
+            if t == title and (not year or date.startswith(year))
+        ]
+        return web.json_response({"results": results})
+
+    async def lookup(request):
+        tmdb_id = int(request.match_info["tmdb_id"])
+        title, date = movies[tmdb_id]
+        return web.json_response(
+            {
+                "id": tmdb_id,
+                "title": title,
+                "release_date": date,
+                "popularity": 1,
+                "vote_average": 7,
+                "vote_count": 100,
+                "imdb_id": f"tt{tmdb_id}",
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get("/3/search/movie", search)
+    app.router.add_get("/3/movie/{tmdb_id}", lookup)
+    return app
+
+
+def enrich(media_list, title_index):
+    """
+    Enrich media with TMDB data from the stand-in, using title_index.
+    """
+
+    async def run():
+        runner = web.AppRunner(create_tmdb_app())
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        base_url = f"http://127.0.0.1:{runner.addresses[0][1]}/3"
+        try:
+            return await tmdb._get_tmdb_media_list_async(
+                "key",
+                media_list,
+                base_url=base_url,
+                requests_per_second=None,
+                title_index=title_index,
+            )
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(run())
+
+
+def build_fixture_index(tmp_path):
+    index_filename = str(tmp_path / "tmdb-movie-ids.idx")
+    build_title_index(FIXTURE_EXPORT, index_filename)
+    return TitleIndex({"movie": index_filename})
+
+
+def test_index_keeps_only_clear_favourites(tmp_path):
+    title_index = build_fixture_index(tmp_path)
+    assert title_index.get({"mediaType": "movie", "title": "Dune"}) == 438631
+    # The 2006 film's original title is 괴물, so its remake looks unambiguous
+    assert title_index.get({"mediaType": "movie", "title": "The Host"}) == 72190
+    assert title_index.get({"mediaType": "show", "title": "Dune"}) is None
+
+
+def test_remake_year_mismatch_is_searched(tmp_path, monkeypatch):
+    title_index = build_fixture_index(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    media_list = [
+        {"mediaType": "movie", "title": "Dune", "year": "1984"},
+        {"mediaType": "movie", "title": "Dune", "year": "2021"},
+        {"mediaType": "movie", "title": "The Host", "year": "2006"},
+    ]
+    results = enrich(media_list, title_index)
+    assert [media["tmdbID"] for media in results] == [841, 438631, 1255]
+
+    # Cached resolutions come from the search or a confirmed year, so a second
+    # run without the index agrees
+    results = enrich(media_list, None)
+    assert [media["tmdbID"] for media in results] == [841, 438631, 1255]
+
+
+def test_resolution_without_year_is_not_cached(tmp_path, monkeypatch):
+    title_index = build_fixture_index(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    media = {"mediaType": "movie", "title": "Dune"}
+    assert enrich([media], title_index)[0]["tmdbID"] == 438631
+
+    cache = tmdb.open_cache("json")
+    try:
+        assert cache.get(tmdb.get_cache_key(media)) is None
+    finally:
+        cache.close()